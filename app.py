@@ -4,6 +4,7 @@ from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
 from sqlalchemy.orm import DeclarativeBase
+from sqlalchemy.schema import CreateIndex
 from werkzeug.middleware.proxy_fix import ProxyFix
 from config import app_config
 
@@ -50,3 +51,11 @@ with app.app_context():
     import models  # noqa: F401
     
     db.create_all()
+    
+    # create_all() skips tables that already exist, so indexes added to an
+    # existing model are created here. IF NOT EXISTS instead of checkfirst:
+    # reflection does not report expression indexes on every database.
+    with db.engine.begin() as conn:
+        for table in db.metadata.sorted_tables:
+            for index in table.indexes:
+                conn.execute(CreateIndex(index, if_not_exists=True))
@@ -1,12 +1,13 @@
 from datetime import datetime
 from functools import wraps
-from flask import Blueprint, render_template, redirect, url_for, flash, request, abort
+from flask import Blueprint, render_template, redirect, url_for, flash, request, abort, jsonify
 from flask_login import login_user, logout_user, login_required, current_user
 from sqlalchemy.exc import IntegrityError
 from werkzeug.security import generate_password_hash
 
 from app import db
-from models import User, Role, Permission
+from sqlalchemy.orm import selectinload
+from models import User, Role, Permission, bump_permission_version, get_auth_cache_stats
 
 auth_bp = Blueprint('auth', __name__)
 
@@ -80,7 +81,7 @@ def logout():
 @login_required
 @admin_required
 def users():
-    users = User.query.all()
+    users = User.query.options(selectinload(User.roles)).all()
     roles = Role.query.all()
     return render_template('auth/users.html', users=users, roles=roles)
 
@@ -171,6 +172,7 @@ def edit_user(id):
                     user.roles.append(role)
             
             db.session.commit()
+            bump_permission_version()
             flash('Gebruiker succesvol bijgewerkt!', 'success')
             return redirect(url_for('auth.users'))
         except IntegrityError:
@@ -196,6 +198,7 @@ def delete_user(id):
     try:
         db.session.delete(user)
         db.session.commit()
+        bump_permission_version()
         flash('Gebruiker succesvol verwijderd!', 'success')
     except Exception as e:
         db.session.rollback()
@@ -207,7 +210,7 @@ def delete_user(id):
 @login_required
 @admin_required
 def roles():
-    roles = Role.query.all()
+    roles = Role.query.options(selectinload(Role.permissions), selectinload(Role.users)).all()
     permissions = Permission.query.all()
     return render_template('auth/roles.html', roles=roles, permissions=permissions)
 
@@ -276,6 +279,7 @@ def edit_role(id):
                     role.permissions.append(permission)
             
             db.session.commit()
+            bump_permission_version()
             flash('Rol succesvol bijgewerkt!', 'success')
             return redirect(url_for('auth.roles'))
         except IntegrityError:
@@ -301,6 +305,7 @@ def delete_role(id):
     try:
         db.session.delete(role)
         db.session.commit()
+        bump_permission_version()
         flash('Rol succesvol verwijderd!', 'success')
     except Exception as e:
         db.session.rollback()
@@ -312,7 +317,7 @@ def delete_role(id):
 @login_required
 @admin_required
 def permissions():
-    permissions = Permission.query.all()
+    permissions = Permission.query.options(selectinload(Permission.roles)).all()
     return render_template('auth/permissions.html', permissions=permissions)
 
 @auth_bp.route('/permissions/add', methods=['GET', 'POST'])
@@ -360,6 +365,7 @@ def edit_permission(id):
             permission.name = name
             permission.description = description
             db.session.commit()
+            bump_permission_version()
             flash('Permissie succesvol bijgewerkt!', 'success')
             return redirect(url_for('auth.permissions'))
         except IntegrityError:
@@ -380,6 +386,7 @@ def delete_permission(id):
     try:
         db.session.delete(permission)
         db.session.commit()
+        bump_permission_version()
         flash('Permissie succesvol verwijderd!', 'success')
     except Exception as e:
         db.session.rollback()
@@ -387,6 +394,24 @@ def delete_permission(id):
     
     return redirect(url_for('auth.permissions'))
 
+@auth_bp.route('/cache-stats')
+@login_required
+@admin_required
+def cache_stats():
+    """Hit rates of the user, permission and RDW caches in this worker"""
+    import rdw_cache
+    stats = get_auth_cache_stats()
+    stats['rdw'] = rdw_cache.get_stats()
+    return jsonify(stats)
+
+@auth_bp.route('/email-outbox')
+@login_required
+@admin_required
+def email_outbox_stats():
+    """Queue depth of the email outbox"""
+    import email_service
+    return jsonify(email_service.get_outbox_stats())
+
 # Initialize default roles and permissions
 def init_auth():
     # Create default permissions if they don't exist
@@ -476,6 +501,7 @@ def init_auth():
     
     try:
         db.session.commit()
+        bump_permission_version()
     except Exception as e:
         db.session.rollback()
         print(f"Error assigning permissions to roles: {str(e)}")
\ No newline at end of file
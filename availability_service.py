@@ -0,0 +1,117 @@
+"""
+Vehicle availability for date ranges.
+
+A vehicle is booked from ``start_date`` up to and including ``end_date`` by
+every rental that is still active (reservations in the future are active
+rentals too); completed and cancelled rentals no longer block it. Two
+ranges overlap when each starts on or before the other one ends.
+
+Checks ("does this booking overlap?", "which vehicles are free?") run in
+SQL on the ``(vehicle_id, start_date, end_date)`` index.
+
+``Vehicle.status`` follows the bookings: a vehicle is 'rented' while one of
+its active rentals covers today. Rental writes refresh the vehicles they
+touch; reservations that start (or end) on a later day are picked up by
+``flask sync-vehicle-status``, run daily.
+"""
+import logging
+from datetime import date
+
+from sqlalchemy import and_, exists, not_, update
+
+from app import db
+from models import Rental, Vehicle
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Rental statuses that keep a vehicle booked
+BLOCKING_STATUSES = ('active',)
+# Vehicles in maintenance cannot be rented, whatever their bookings
+UNAVAILABLE_VEHICLE_STATUSES = ('maintenance',)
+
+
+def overlap_condition(start_date, end_date):
+    """SQL condition for blocking rentals overlapping ``start_date``..``end_date``"""
+    return and_(
+        Rental.start_date <= end_date,
+        Rental.end_date >= start_date,
+        Rental.status.in_(BLOCKING_STATUSES),
+    )
+
+
+def overlapping_rentals(vehicle_id, start_date, end_date, exclude_rental_id=None):
+    """
+    Blocking rentals of a vehicle that overlap the given range
+
+    Args:
+        vehicle_id (int): Vehicle to check
+        start_date (date): First day of the range
+        end_date (date): Last day of the range (inclusive)
+        exclude_rental_id (int): Rental to leave out, when editing it
+
+    Returns:
+        list: Overlapping rentals, ordered by start date
+    """
+    query = Rental.query.filter(Rental.vehicle_id == vehicle_id, overlap_condition(start_date, end_date))
+    if exclude_rental_id is not None:
+        query = query.filter(Rental.id != exclude_rental_id)
+    return query.order_by(Rental.start_date).all()
+
+
+def is_available(vehicle_id, start_date, end_date, exclude_rental_id=None):
+    """Whether the vehicle has no blocking rental in the given range"""
+    query = db.session.query(Rental.id).filter(Rental.vehicle_id == vehicle_id, overlap_condition(start_date, end_date))
+    if exclude_rental_id is not None:
+        query = query.filter(Rental.id != exclude_rental_id)
+    return query.first() is None
+
+
+def free_vehicles_query(start_date, end_date, exclude_rental_id=None):
+    """
+    Query for the vehicles that are free for the whole range
+
+    Each vehicle is checked with a correlated NOT EXISTS that is answered
+    from the ``(vehicle_id, start_date, end_date)`` index.
+    """
+    conditions = [Rental.vehicle_id == Vehicle.id, overlap_condition(start_date, end_date)]
+    if exclude_rental_id is not None:
+        conditions.append(Rental.id != exclude_rental_id)
+    return Vehicle.query.filter(
+        Vehicle.status.notin_(UNAVAILABLE_VEHICLE_STATUSES),
+        not_(exists().where(and_(*conditions))),
+    )
+
+
+def free_vehicles(start_date, end_date, exclude_rental_id=None):
+    """Vehicles that are free for the whole range, ordered by make and model"""
+    return free_vehicles_query(start_date, end_date, exclude_rental_id).order_by(
+        Vehicle.make, Vehicle.model, Vehicle.license_plate
+    ).all()
+
+
+def refresh_vehicle_status(vehicle_ids=None, today=None):
+    """
+    Set vehicles to 'rented' or 'available' from the bookings covering today
+
+    Vehicles in maintenance are left alone. Runs as two UPDATE statements in
+    the current transaction; the caller commits.
+
+    Args:
+        vehicle_ids (list): Vehicles to refresh (default: all)
+        today (date): Day to check (default: today)
+
+    Returns:
+        int: Number of vehicles whose status changed
+    """
+    today = today or date.today()
+    booked = exists().where(and_(Rental.vehicle_id == Vehicle.id, overlap_condition(today, today)))
+    scope = [Vehicle.id.in_(vehicle_ids)] if vehicle_ids is not None else []
+    changed = 0
+    for status, condition in (('rented', booked), ('available', not_(booked))):
+        other = 'available' if status == 'rented' else 'rented'
+        changed += db.session.execute(
+            update(Vehicle).where(Vehicle.status == other, condition, *scope).values(status=status),
+            execution_options={'synchronize_session': False},
+        ).rowcount
+    return changed
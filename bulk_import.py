@@ -0,0 +1,409 @@
+"""
+Bulkimport van klanten en voertuigen uit een CSV-bestand.
+
+Het bestand wordt als stroom gelezen en per ``batch_size`` regels
+verwerkt: eerst worden alle regels van de batch gecontroleerd, dan zoekt
+één query welke klanten of voertuigen al bestaan (op de unieke kolommen),
+en daarna gaan de nieuwe regels met één bulk-INSERT en de gewijzigde met
+één bulk-UPDATE de database in, waarna de batch wordt gecommit.
+
+Bestaande records worden bijgewerkt in plaats van dubbel aangemaakt, dus
+hetzelfde bestand nogmaals importeren is veilig. Een lege cel laat de
+bestaande waarde staan; een waarde wissen kan alleen via het formulier. Regels met fouten worden
+overgeslagen en per regelnummer gerapporteerd.
+
+De kolomkoppen mogen Nederlands of Engels zijn; een export uit
+``export_service`` kan dus direct weer ingelezen worden.
+"""
+import csv
+import itertools
+import logging
+import re
+from dataclasses import dataclass, field
+from datetime import date
+
+from sqlalchemy import func, insert, or_, update
+
+from app import db
+from models import Customer, Vehicle, normalized_plate
+from rdw_api import RDWApi
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 1000
+
+# Uitkomst per regel
+INSERTED = 'inserted'
+UPDATED = 'updated'
+UNCHANGED = 'unchanged'
+ERROR = 'error'
+
+VEHICLE_STATUSES = ('available', 'rented', 'maintenance')
+EMAIL_PATTERN = re.compile(r'^[^@\s]+@[^@\s]+\.[^@\s]+$')
+PLATE_PATTERN = re.compile(r'^[A-Z0-9]{1,20}$')
+# 123456, of met duizendtalscheiding: 123.456 / 123 456 / 123,456
+MILEAGE_PATTERN = re.compile(r'^\d{1,3}(?:([., ])\d{3})?(?:\1\d{3})*$|^\d+$')
+FIRST_YEAR = 1900
+
+
+class RowError(ValueError):
+    """Ongeldige waarde in een regel"""
+
+
+@dataclass
+class RowResult:
+    """Uitkomst van de import voor één regel"""
+    line: int
+    key: str
+    status: str
+    message: str = ''
+
+
+@dataclass
+class ImportReport:
+    """Totalen per uitkomst plus de regels die niet geïmporteerd zijn"""
+    counts: dict = field(default_factory=lambda: {INSERTED: 0, UPDATED: 0, UNCHANGED: 0, ERROR: 0})
+    errors: list = field(default_factory=list)
+
+    @property
+    def total(self):
+        return sum(self.counts.values())
+
+    def add(self, result):
+        self.counts[result.status] += 1
+        if result.status == ERROR:
+            self.errors.append(result)
+
+
+# Waardeparsers: krijgen de ruwe celtekst (gestript, mogelijk leeg)
+
+def _text(max_length):
+    def parse(value):
+        if len(value) > max_length:
+            raise RowError(f"langer dan {max_length} tekens")
+        return value or None
+    return parse
+
+
+def _year(value):
+    if not value:
+        return None
+    if not value.isdigit() or len(value) != 4:
+        raise RowError(f"'{value}' is geen bouwjaar")
+    year = int(value)
+    if not FIRST_YEAR <= year <= date.today().year + 1:
+        raise RowError(f"bouwjaar {year} ligt niet tussen {FIRST_YEAR} en {date.today().year + 1}")
+    return year
+
+
+def _mileage(value):
+    if not value:
+        return None
+    # Alleen hier een duizendtalscheiding: bij een bouwjaar maakt '2015.0' er anders 20150 van
+    if not MILEAGE_PATTERN.match(value):
+        raise RowError(f"'{value}' is geen kilometerstand")
+    return int(re.sub(r'[., ]', '', value))
+
+
+def _amount(value):
+    if not value:
+        return None
+    # 1.234,50 en 1234.50 worden allebei geaccepteerd
+    normalized = value.replace('€', '').replace(' ', '')
+    if ',' in normalized:
+        normalized = normalized.replace('.', '').replace(',', '.')
+    try:
+        return float(normalized)
+    except ValueError:
+        raise RowError(f"'{value}' is geen bedrag")
+
+
+def _email(value):
+    if not value:
+        return None
+    if len(value) > 100 or not EMAIL_PATTERN.match(value):
+        raise RowError(f"'{value}' is geen geldig e-mailadres")
+    return value.lower()
+
+
+def _license_plate(value):
+    if not value:
+        return None
+    plate = RDWApi.normalize_plate(value)
+    if not PLATE_PATTERN.match(plate):
+        raise RowError(f"'{value}' is geen geldig kenteken")
+    return plate
+
+
+def _vehicle_status(value):
+    if not value:
+        return None
+    if value.lower() not in VEHICLE_STATUSES:
+        raise RowError(f"onbekende status '{value}'")
+    return value.lower()
+
+
+@dataclass
+class Field:
+    """Een kolom van het importbestand"""
+    name: str
+    headers: tuple
+    parse: object
+    required: bool = False
+    # Waarde voor nieuwe records bij een lege cel
+    default: object = None
+
+
+@dataclass
+class ImportSpec:
+    """Wat er per soort import ingelezen wordt en waarop bestaande records gevonden worden"""
+    model: object
+    fields: list
+    unique: tuple
+    label: str
+
+    def row_key(self, values):
+        return ' / '.join(str(values.get(name) or '') for name in self.unique)
+
+
+IMPORTS = {
+    'customers': ImportSpec(
+        model=Customer,
+        label='klanten',
+        unique=('email', 'driver_license'),
+        fields=[
+            Field('first_name', ('voornaam', 'klant voornaam', 'first_name'), _text(50), required=True),
+            Field('last_name', ('achternaam', 'klant achternaam', 'last_name'), _text(50), required=True),
+            Field('email', ('e-mail', 'email', 'e-mailadres', 'klant e-mail'), _email, required=True),
+            Field('phone', ('telefoon', 'telefoonnummer', 'phone'), _text(20)),
+            Field('address', ('adres', 'address'), _text(200)),
+            Field('driver_license', ('rijbewijs', 'rijbewijsnummer', 'driver_license'), _text(50), required=True),
+        ],
+    ),
+    'vehicles': ImportSpec(
+        model=Vehicle,
+        label='voertuigen',
+        unique=('license_plate',),
+        fields=[
+            Field('license_plate', ('kenteken', 'license_plate'), _license_plate, required=True),
+            Field('make', ('merk', 'make'), _text(50), required=True),
+            Field('model', ('model',), _text(50), required=True),
+            Field('year', ('bouwjaar', 'jaar', 'year'), _year, required=True),
+            Field('daily_rate', ('dagprijs', 'daily_rate'), _amount, required=True),
+            Field('status', ('status',), _vehicle_status, default='available'),
+            Field('color', ('kleur', 'color'), _text(20)),
+            Field('mileage', ('kilometerstand', 'mileage'), _mileage),
+        ],
+    ),
+}
+
+
+def _normalize_header(name):
+    return name.lstrip('\ufeff').strip().lower().replace('_', ' ')
+
+
+def _reader(fileobj):
+    """
+    CSV-lezer over een tekststroom; het scheidingsteken (komma, puntkomma of
+    tab) wordt uit de kopregel afgeleid
+    """
+    header_line = fileobj.readline()
+    delimiter = max(',;\t', key=header_line.count)
+    return csv.reader(itertools.chain([header_line], fileobj), delimiter=delimiter)
+
+
+def _column_map(spec, header):
+    """Kolomindex per veld; ValueError als een verplichte kolom ontbreekt"""
+    positions = {_normalize_header(name): index for index, name in enumerate(header)}
+    columns = {}
+    for spec_field in spec.fields:
+        for alias in spec_field.headers:
+            index = positions.get(_normalize_header(alias))
+            if index is not None:
+                columns[spec_field.name] = index
+                break
+    missing = [f.headers[0] for f in spec.fields if f.required and f.name not in columns]
+    if missing:
+        raise ValueError(f"Verplichte kolom(men) ontbreken: {', '.join(missing)}")
+    return columns
+
+
+def _parse_row(spec, columns, row):
+    """Waarden van één regel; RowError met alle fouten van de regel"""
+    values = {}
+    problems = []
+    for spec_field in spec.fields:
+        if spec_field.name not in columns:
+            continue
+        index = columns[spec_field.name]
+        raw = row[index].strip() if index < len(row) else ''
+        try:
+            value = spec_field.parse(raw)
+        except RowError as e:
+            problems.append(f"{spec_field.headers[0]}: {e}")
+            continue
+        if value is None and spec_field.required:
+            problems.append(f"{spec_field.headers[0]} is verplicht")
+        values[spec_field.name] = value
+    if problems:
+        raise RowError('; '.join(problems))
+    return values
+
+
+def _match_value(name, value):
+    """Waarde zoals unieke kolommen vergeleken worden (kenteken zonder streepjes, e-mail in kleine letters)"""
+    if value is None:
+        return None
+    if name == 'license_plate':
+        return RDWApi.normalize_plate(value)
+    if name == 'email':
+        return value.lower()
+    return value
+
+
+def _match_column(spec, name):
+    """
+    SQL-expressie voor ``_match_value`` op een unieke kolom; gelijk aan de
+    expressie-indexen in models.py, zodat de controle per batch een index gebruikt
+    """
+    column = getattr(spec.model, name)
+    if name == 'license_plate':
+        # Bestaande kentekens kunnen met streepjes of spaties zijn ingevoerd
+        return normalized_plate(column)
+    if name == 'email':
+        return func.lower(column)
+    return column
+
+
+def _find_existing(spec, batch):
+    """
+    Bestaande records voor de unieke waarden in de batch, in één query
+
+    Returns:
+        dict: (kolom, waarde) -> record als dict
+    """
+    conditions = []
+    for name in spec.unique:
+        wanted = {values[name] for _line, values in batch if values.get(name)}
+        if wanted:
+            conditions.append(_match_column(spec, name).in_(wanted))
+    if not conditions:
+        return {}
+
+    names = ['id'] + [f.name for f in spec.fields]
+    existing = {}
+    for record in db.session.query(*[getattr(spec.model, name) for name in names]).filter(or_(*conditions)):
+        record = dict(zip(names, record))
+        for name in spec.unique:
+            if record[name] is not None:
+                existing[(name, _match_value(name, record[name]))] = record
+    return existing
+
+
+def _import_batch(spec, batch, report, dry_run):
+    """Controleer een batch tegen de database en schrijf hem weg"""
+    existing = _find_existing(spec, batch)
+    defaults = {f.name: f.default for f in spec.fields if f.default is not None}
+    inserts = []
+    updates = []
+    outcomes = []
+
+    for line, values in batch:
+        key = spec.row_key(values)
+        matches = {existing[(name, values[name])]['id']: existing[(name, values[name])]
+                   for name in spec.unique if (name, values.get(name)) in existing}
+        if len(matches) > 1:
+            outcomes.append(RowResult(line, key, ERROR, 'Waarden horen bij verschillende bestaande records'))
+            continue
+        if not matches:
+            inserts.append({**values, **{name: default for name, default in defaults.items()
+                                         if values.get(name) is None}})
+            outcomes.append(RowResult(line, key, INSERTED))
+            continue
+
+        record = next(iter(matches.values()))
+        # Een kenteken met of zonder streepjes is niet gewijzigd, en een lege
+        # cel laat de huidige waarde staan
+        changes = {name: value for name, value in values.items()
+                   if value is not None
+                   and _match_value(name, record[name]) != _match_value(name, value)}
+        if not changes:
+            outcomes.append(RowResult(line, key, UNCHANGED))
+        else:
+            updates.append({'id': record['id'], **changes})
+            outcomes.append(RowResult(line, key, UPDATED))
+
+    if not dry_run and (inserts or updates):
+        try:
+            if inserts:
+                db.session.execute(insert(spec.model), inserts)
+            # Bulk-UPDATE op primaire sleutel; één executemany per set gewijzigde kolommen
+            for _columns, group in itertools.groupby(sorted(updates, key=lambda u: sorted(u)), key=lambda u: sorted(u)):
+                db.session.execute(update(spec.model), list(group))
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Bulkimport van {spec.label} mislukt voor een batch: {e}")
+            outcomes = [result if result.status in (UNCHANGED, ERROR)
+                        else RowResult(result.line, result.key, ERROR, f'Batch niet opgeslagen: {e}')
+                        for result in outcomes]
+
+    for result in outcomes:
+        report.add(result)
+
+
+def import_csv(fileobj, kind, batch_size=DEFAULT_BATCH_SIZE, dry_run=False):
+    """
+    Importeer klanten of voertuigen uit een CSV-bestand
+
+    Args:
+        fileobj: Tekststroom met de CSV (met kolomkoppen)
+        kind (str): ``'customers'`` of ``'vehicles'``
+        batch_size (int): Aantal regels per controle-query en transactie
+        dry_run (bool): Alleen controleren, niets opslaan
+
+    Returns:
+        ImportReport: Totalen en de regels met fouten
+
+    Raises:
+        ValueError: Als het bestand leeg is of een verplichte kolom mist
+    """
+    spec = IMPORTS[kind]
+    reader = _reader(fileobj)
+    header = next(reader, None)
+    if not header:
+        raise ValueError("Het bestand is leeg")
+    columns = _column_map(spec, header)
+
+    report = ImportReport()
+    # Unieke waarden die eerder in het bestand al voorkwamen
+    seen = {name: {} for name in spec.unique}
+    batch = []
+    for row in reader:
+        if not any(cell.strip() for cell in row):
+            continue
+        line = reader.line_num
+        try:
+            values = _parse_row(spec, columns, row)
+        except RowError as e:
+            report.add(RowResult(line, '', ERROR, str(e)))
+            continue
+
+        duplicate = next((name for name in spec.unique if values.get(name) in seen[name]), None)
+        if duplicate:
+            report.add(RowResult(line, spec.row_key(values), ERROR,
+                                 f"Dubbel in het bestand (zie regel {seen[duplicate][values[duplicate]]})"))
+            continue
+        for name in spec.unique:
+            seen[name][values[name]] = line
+
+        batch.append((line, values))
+        if len(batch) >= batch_size:
+            _import_batch(spec, batch, report, dry_run)
+            batch = []
+    if batch:
+        _import_batch(spec, batch, report, dry_run)
+
+    logger.info(f"Bulkimport {spec.label}: {report.counts}")
+    return report
@@ -0,0 +1,178 @@
+"""
+Small in-process caches and write-based invalidation.
+
+The caches live per worker process. Every worker invalidates its own copy
+when a watched model is written through the ORM; writes made by other
+workers are picked up when the TTL expires.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+_MISSING = object()
+
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries expire after ``ttl`` seconds"""
+
+    def __init__(self, ttl, maxsize=None):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+
+    def get(self, key, default=None):
+        """Return the cached value for ``key`` or ``default``"""
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is _MISSING:
+                self.misses += 1
+                return default
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                self.expired += 1
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        """Store ``value`` under ``key``, optionally with a custom TTL"""
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            if self.maxsize is not None:
+                while len(self._data) > self.maxsize:
+                    self._data.popitem(last=False)
+
+    def get_or_set(self, key, factory):
+        """
+        Return the cached value, computing it with ``factory()`` on a miss
+
+        Concurrent misses for the same key wait for a single computation
+        instead of all running ``factory`` at once.
+        """
+        value = self.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            # Another thread may have filled the entry while we waited
+            with self._lock:
+                entry = self._data.get(key, _MISSING)
+            if entry is not _MISSING and entry[0] > time.monotonic():
+                return entry[1]
+            value = factory()
+            self.set(key, value)
+        with self._lock:
+            self._key_locks.pop(key, None)
+        return value
+
+    def invalidate(self, key):
+        """Remove a single entry"""
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        """Remove all entries"""
+        with self._lock:
+            self._data.clear()
+
+    def items(self):
+        """Snapshot of the (key, value) pairs that have not expired"""
+        now = time.monotonic()
+        with self._lock:
+            return [(key, value) for key, (expires_at, value) in self._data.items() if expires_at > now]
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        """Hit/miss counters for monitoring"""
+        total = self.hits + self.misses
+        return {
+            'size': len(self._data),
+            'hits': self.hits,
+            'misses': self.misses,
+            'expired': self.expired,
+            'hit_rate': round(self.hits / total, 3) if total else 0.0,
+        }
+
+
+# Callbacks registered per model class: [(models, callback), ...]
+_write_listeners = []
+
+
+def on_model_change(*models):
+    """
+    Register ``callback(instances)`` to run after a commit that inserted,
+    updated or deleted instances of one of ``models``
+
+    ``instances`` is None when the change came from a bulk ORM statement
+    such as ``session.execute(insert(Vehicle), rows)``, where the affected
+    rows are unknown.
+
+    Usage:
+        @on_model_change(Vehicle, Rental)
+        def _changed(instances):
+            ...
+    """
+    def decorator(callback):
+        _write_listeners.append((tuple(models), callback))
+        return callback
+    return decorator
+
+
+def invalidate_on_write(cache, *models):
+    """Clear ``cache`` whenever one of ``models`` is written"""
+    on_model_change(*models)(lambda instances: cache.clear())
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_changes(session, flush_context):
+    changed = session.info.setdefault('changed_instances', [])
+    changed.extend(session.new)
+    changed.extend(session.dirty)
+    changed.extend(session.deleted)
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def _collect_bulk_changes(orm_execute_state):
+    if not (orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete):
+        return
+    mapper = orm_execute_state.bind_mapper
+    if mapper is not None:
+        orm_execute_state.session.info.setdefault('changed_classes', set()).add(mapper.class_)
+
+
+@event.listens_for(Session, 'after_commit')
+def _notify_changes(session):
+    changed = session.info.pop('changed_instances', None) or []
+    bulk_classes = session.info.pop('changed_classes', None) or set()
+    if not changed and not bulk_classes:
+        return
+    for models, callback in _write_listeners:
+        if any(issubclass(cls, models) for cls in bulk_classes):
+            callback(None)
+            continue
+        instances = [obj for obj in changed if isinstance(obj, models)]
+        if instances:
+            callback(instances)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_changes(session):
+    session.info.pop('changed_instances', None)
+    session.info.pop('changed_classes', None)
@@ -0,0 +1,334 @@
+"""
+Beheercommando's voor de Flask CLI (``flask --app main <commando>``).
+"""
+import re
+import sys
+from contextlib import contextmanager
+from datetime import date, timedelta
+
+import click
+from sqlalchemy import event
+from werkzeug.datastructures import MultiDict
+
+from app import app, db
+
+# "SCAN rental" (or "SCAN TABLE rental" on older SQLite) without an index
+_FULL_SCAN = re.compile(r'^SCAN (TABLE )?(\w+)$')
+
+# Route queries allowed to scan a table, provided they scan it in the sort
+# order of the page (no temporary B-tree for ORDER BY): the scan then stops
+# after one page instead of reading and sorting the whole table
+ACCEPTED_SCANS = {
+    'vehicles (first page)': 'primary key order, stops after one page',
+    'vehicles (make/model search)': "ILIKE '%...%' cannot use a B-tree index; walks the primary key until a page is full",
+    'rentals (first page)': 'primary key order (newest first), stops after one page',
+    'rentals (date range filter)': 'an overlap test cannot be bounded by one index; walks the primary key until a page is full',
+    'rentals (customer/vehicle search)': "ILIKE '%...%' cannot use a B-tree index; walks the primary key until a page is full",
+}
+
+
+@contextmanager
+def _capture_statements():
+    """Collect every statement the ORM sends to the database"""
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith('SELECT'):
+            statements.append((statement, parameters))
+
+    event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+
+
+def _route_queries():
+    """
+    Run the filtering/sorting queries of the routes, keyed by a label
+
+    The same code paths as the routes are used, so the captured SQL is what
+    production runs.
+    """
+    import availability_service
+    import bulk_import
+    import dashboard_service
+    import document_service
+    import report_service
+    from models import Customer, Rental, Vehicle, VehicleExpense
+    from pagination import encode_cursor, keyset_paginate
+    from routes import RENTAL_SORT_COLUMNS, VEHICLE_SORT_COLUMNS, apply_rental_filters, apply_vehicle_filters
+
+    today = date.today()
+
+    yield 'dashboard', lambda: dashboard_service._build_dashboard_data(today)
+    yield 'vehicles (first page)', lambda: keyset_paginate(Vehicle.query, [Vehicle.id])
+    yield 'vehicles (status filter)', lambda: keyset_paginate(
+        apply_vehicle_filters(Vehicle.query, MultiDict({'status': 'available'})),
+        [Vehicle.id], cursor=encode_cursor([1]))
+    yield 'vehicles (make/model search)', lambda: keyset_paginate(
+        apply_vehicle_filters(Vehicle.query, MultiDict({'make': 'vo', 'model': 'go'})), [Vehicle.id])
+    for key, column in VEHICLE_SORT_COLUMNS.items():
+        if key == 'id':
+            continue
+        yield f'vehicles (sort {key})', lambda column=column: keyset_paginate(
+            Vehicle.query, [column, Vehicle.id])
+        yield f'vehicles (sort -{key}, next page)', lambda column=column: keyset_paginate(
+            Vehicle.query, [column, Vehicle.id], descending=True,
+            cursor=encode_cursor([1 if column.type.python_type in (int, float) else 'x', 1]))
+    yield 'rentals (first page)', lambda: keyset_paginate(
+        Rental.query_with_relations(), [Rental.id], descending=True)
+    yield 'rentals (status + date filter)', lambda: keyset_paginate(
+        apply_rental_filters(Rental.query_with_relations(), MultiDict({
+            'status': 'active', 'date_from': (today - timedelta(days=30)).isoformat()})),
+        [Rental.id], cursor=encode_cursor([10**9]), descending=True)
+    yield 'rentals (date range filter)', lambda: keyset_paginate(
+        apply_rental_filters(Rental.query_with_relations(), MultiDict({
+            'date_from': (today - timedelta(days=30)).isoformat(), 'date_to': today.isoformat()})),
+        [Rental.id], descending=True)
+    yield 'rentals (customer/vehicle search)', lambda: keyset_paginate(
+        apply_rental_filters(Rental.query_with_relations(), MultiDict({'customer': 'jan', 'vehicle': 'golf'})),
+        [Rental.id], descending=True)
+    for key, column in RENTAL_SORT_COLUMNS.items():
+        if key == 'id':
+            continue
+        yield f'rentals (sort {key})', lambda column=column: keyset_paginate(
+            Rental.query_with_relations(), [column, Rental.id], descending=True,
+            cursor=encode_cursor([today, 10**9]))
+    yield 'revenue report', lambda: report_service._query_revenue(
+        *report_service.default_revenue_range(today), 'month')
+    yield 'delete_vehicle active rental check', lambda: Rental.query.filter_by(
+        vehicle_id=1, status='active').first()
+    yield 'rental overlap check', lambda: availability_service.overlapping_rentals(
+        1, today, today + timedelta(days=30))
+    yield 'delete_customer active rental check', lambda: Rental.query.filter_by(
+        customer_id=1, status='active').first()
+    yield 'vehicle_expenses', lambda: VehicleExpense.query.filter_by(
+        vehicle_id=1).order_by(VehicleExpense.date.desc()).all()
+    yield 'vehicle_documents', lambda: document_service.get_vehicle_documents(1)
+    yield 'customer lookup', lambda: Customer.query.filter_by(email='x@example.com').first()
+    yield 'bulk import vehicle match', lambda: bulk_import._find_existing(
+        bulk_import.IMPORTS['vehicles'], [(2, {'license_plate': 'AB12CD'})])
+    yield 'bulk import customer match', lambda: bulk_import._find_existing(
+        bulk_import.IMPORTS['customers'], [(2, {'email': 'x@example.com', 'driver_license': 'D1'})])
+
+
+@app.cli.command('check-query-plans')
+def check_query_plans():
+    """Fail if a route query falls back to a full table scan (SQLite only)."""
+    if db.engine.dialect.name != 'sqlite':
+        click.echo(f"EXPLAIN QUERY PLAN controle werkt alleen op SQLite, niet op {db.engine.dialect.name}")
+        return
+
+    failures = []
+    accepted = 0
+    for label, run in _route_queries():
+        with _capture_statements() as statements:
+            run()
+        db.session.rollback()
+
+        for statement, parameters in statements:
+            with db.engine.connect() as conn:
+                plan = conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters).all()
+            sorts_table = any('TEMP B-TREE FOR ORDER BY' in row[-1] for row in plan)
+            for row in plan:
+                detail = row[-1]
+                if _FULL_SCAN.match(detail) and label in ACCEPTED_SCANS and not sorts_table:
+                    accepted += 1
+                    click.echo(f"scan  {label}: {detail} ({ACCEPTED_SCANS[label]})")
+                elif _FULL_SCAN.match(detail):
+                    failures.append((label, detail, statement))
+                    click.echo(f"FAIL  {label}: {detail}")
+                else:
+                    click.echo(f"ok    {label}: {detail}")
+
+    if failures:
+        click.echo(f"\n{len(failures)} query/queries doen een volledige table scan:")
+        for label, detail, statement in failures:
+            click.echo(f"- {label}: {detail}\n  {' '.join(statement.split())}")
+        sys.exit(1)
+
+    click.echo(f"\nAlle route-queries gebruiken een index, op {accepted} geaccepteerde scan(s) "
+               f"in sorteervolgorde na (zie ACCEPTED_SCANS).")
+
+
+@app.cli.command('purge-rdw-cache')
+def purge_rdw_cache():
+    """Remove expired entries from the RDW lookup cache."""
+    import rdw_cache
+    deleted = rdw_cache.purge_expired()
+    click.echo(f"{deleted} verlopen RDW-cache-regels verwijderd")
+
+
+@app.cli.command('import-rdw-plates')
+@click.argument('source', type=click.File('r', encoding='utf-8-sig'))
+@click.option('--daily-rate', type=float, required=True, help='Dagprijs voor de nieuwe voertuigen')
+@click.option('--status', default='available', show_default=True)
+@click.option('--batch-size', default=50, show_default=True, help='Kentekens per RDW-verzoek')
+def import_rdw_plates(source, daily_rate, status, batch_size):
+    """Import vehicles from a CSV or plain list of license plates (use - for stdin)."""
+    import fleet_import
+    plates = fleet_import.parse_plates(source.read())
+    results = fleet_import.import_plates(plates, daily_rate, status=status, batch_size=batch_size)
+
+    for result in results:
+        click.echo(f"{result.license_plate:<10} {result.status:<10} {result.message}")
+    added = sum(1 for r in results if r.status == fleet_import.ADDED)
+    click.echo(f"\n{added} van {len(results)} voertuigen geïmporteerd")
+
+
+@app.cli.command('import-rdw-mirror')
+@click.argument('dataset', type=click.Choice(['vehicles', 'fuel']))
+@click.argument('source', type=click.File('r', encoding='utf-8-sig', lazy=False))
+@click.option('--chunk-size', default=5000, show_default=True, help='Regels per transactie')
+def import_rdw_mirror(dataset, source, chunk_size):
+    """Load an RDW open-data CSV export (m9d7-ebf2 or 8ys7-d773) into the local mirror."""
+    import rdw_mirror
+    try:
+        total = rdw_mirror.import_csv(source, dataset, chunk_size=chunk_size)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    click.echo(f"{total} regels ingelezen; lokale kopie bevat nu {rdw_mirror.counts()[dataset]} kentekens")
+
+
+@app.cli.command('generate-thumbnails')
+def generate_thumbnails():
+    """Generate missing thumbnails for all existing image documents."""
+    import storage
+    import thumbnail_service
+    from models import VehicleDocument
+
+    if not thumbnail_service.available():
+        raise click.ClickException("Pillow is niet geïnstalleerd; installeer het met 'pip install Pillow'")
+
+    filepaths = {storage.resolve(document.filepath) for document in VehicleDocument.query.yield_per(500)
+                 if document.is_image()}
+    written = failed = 0
+    for filepath in sorted(filepaths):
+        future = thumbnail_service.schedule(filepath)
+        try:
+            written += future.result()
+        except Exception as e:
+            failed += 1
+            click.echo(f"FOUT  {filepath}: {e}")
+    click.echo(f"{written} thumbnails gemaakt voor {len(filepaths)} afbeeldingen, {failed} mislukt")
+
+
+@app.cli.command('purge-stale-uploads')
+@click.option('--hours', default=24, show_default=True, help='Uploads zonder activiteit langer dan dit verwijderen')
+def purge_stale_uploads(hours):
+    """Remove abandoned chunked uploads and their partial files."""
+    import document_service
+    removed = document_service.purge_stale_uploads(max_age_hours=hours)
+    click.echo(f"{removed} onvoltooide uploads verwijderd")
+
+
+@app.cli.command('purge-orphaned-documents')
+@click.option('--hours', default=24, show_default=True, help='Alleen bestanden die langer dan dit niet gewijzigd zijn')
+def purge_orphaned_documents(hours):
+    """Remove document files that no document refers to any more (run nightly)."""
+    import document_service
+    removed = document_service.purge_orphaned_files(min_age_hours=hours)
+    click.echo(f"{removed} verweesde documentbestanden verwijderd")
+
+
+@app.cli.command('migrate-document-storage')
+@click.option('--batch-size', default=100, show_default=True, help='Bestanden per transactie')
+def migrate_document_storage(batch_size):
+    """Move existing documents into the sharded upload layout (safe to re-run)."""
+    import document_service
+    migrated = failed = 0
+    for moved, errors in document_service.migrate_storage_layout(batch_size=batch_size):
+        migrated += moved
+        failed += len(errors)
+        for filepath, error in errors:
+            click.echo(f"FOUT  {filepath}: {error}")
+        click.echo(f"{migrated} bestanden verplaatst")
+    click.echo(f"Klaar: {migrated} bestanden verplaatst, {failed} mislukt")
+
+
+@app.cli.command('email-worker')
+@click.option('--once', is_flag=True, help='Eén batch versturen en stoppen')
+@click.option('--concurrency', type=int, help='Gelijktijdige verzendingen (standaard EMAIL_WORKERS)')
+@click.option('--batch-size', default=100, show_default=True)
+@click.option('--poll-interval', default=5.0, show_default=True, help='Seconden wachten als de wachtrij leeg is')
+def email_worker(once, concurrency, batch_size, poll_interval):
+    """Send queued emails from the outbox (runs until interrupted)."""
+    import email_service
+    worker = email_service.OutboxWorker(concurrency=concurrency)
+    try:
+        if once:
+            worker.run_once(batch_size)
+        else:
+            click.echo(f"E-mailworker gestart met {worker.concurrency} gelijktijdige verzendingen")
+            worker.run(batch_size=batch_size, poll_interval=poll_interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        worker.close()
+    click.echo(f"Verstuurd: {worker.stats['sent']}, opnieuw gepland: {worker.stats['retried']}, "
+               f"mislukt: {worker.stats['dead']} ({worker.throughput()} per minuut)")
+    click.echo(f"Wachtrij: {email_service.get_outbox_stats()}")
+
+
+@app.cli.command('email-retry-dead')
+@click.argument('email_ids', nargs=-1, type=int)
+def email_retry_dead(email_ids):
+    """Requeue dead-lettered emails (all of them, or the given IDs)."""
+    import email_service
+    count = email_service.retry_dead(list(email_ids) or None)
+    click.echo(f"{count} e-mails opnieuw in de wachtrij gezet")
+
+
+@app.cli.command('sync-vehicle-status')
+def sync_vehicle_status():
+    """Mark vehicles rented or available from today's bookings (run daily)."""
+    import availability_service
+    changed = availability_service.refresh_vehicle_status()
+    db.session.commit()
+    click.echo(f"Status van {changed} voertuig(en) bijgewerkt")
+
+
+@app.cli.command('send-reminders')
+@click.option('--date', 'day', type=click.DateTime(formats=['%Y-%m-%d']), help='Datum (standaard vandaag)')
+@click.option('--batch-size', default=500, show_default=True, type=click.IntRange(1, 1000, clamp=True),
+              help='Ontvangers per e-mailverzoek (max. 1000)')
+@click.option('--overdue-interval', default=1, show_default=True, help='Dagen tussen herinneringen voor te late verhuringen')
+@click.option('--dry-run', is_flag=True, help='Alleen tellen, niets versturen')
+def send_reminders(day, batch_size, overdue_interval, dry_run):
+    """Queue reminder emails for rentals due today or overdue (run nightly)."""
+    import reminder_service
+    result = reminder_service.send_reminders(today=day.date() if day else None, batch_size=batch_size,
+                                             overdue_interval=overdue_interval, dry_run=dry_run)
+    prefix = 'Te versturen' if dry_run else 'In de wachtrij gezet'
+    click.echo(f"{prefix}: {result['due_today']} herinneringen voor vandaag, "
+               f"{result['overdue']} voor te late verhuringen in {result['messages']} e-mailverzoeken")
+
+
+@app.cli.command('import-csv')
+@click.argument('kind', type=click.Choice(['customers', 'vehicles']))
+@click.argument('source', type=click.File('r', encoding='utf-8-sig', lazy=False))
+@click.option('--batch-size', default=1000, show_default=True, help='Regels per controle-query en transactie')
+@click.option('--dry-run', is_flag=True, help='Alleen controleren, niets opslaan')
+@click.option('--report', type=click.File('w', encoding='utf-8'), help='Schrijf de foutregels als CSV naar dit bestand')
+def import_csv(kind, source, batch_size, dry_run, report):
+    """Import or update customers or vehicles from a CSV file (use - for stdin)."""
+    import csv
+    import bulk_import
+    try:
+        result = bulk_import.import_csv(source, kind, batch_size=batch_size, dry_run=dry_run)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+
+    if report:
+        writer = csv.writer(report)
+        writer.writerow(['regel', 'sleutel', 'fout'])
+        writer.writerows([error.line, error.key, error.message] for error in result.errors)
+    else:
+        for error in result.errors:
+            click.echo(f"regel {error.line:<6} {error.key:<30} {error.message}")
+
+    prefix = 'Gecontroleerd' if dry_run else 'Geïmporteerd'
+    counts = result.counts
+    click.echo(f"{prefix}: {counts['inserted']} toegevoegd, {counts['updated']} bijgewerkt, "
+               f"{counts['unchanged']} ongewijzigd, {counts['error']} fout(en)")
@@ -18,14 +18,33 @@ class Config:
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16 MB maximale bestandsgrootte
     ALLOWED_EXTENSIONS = {'pdf', 'png', 'jpg', 'jpeg', 'doc', 'docx', 'xls', 'xlsx'}
     
+    # Downloads laten afhandelen door de webserver: "" (Flask zelf),
+    # "x-accel-redirect" (Nginx) of "x-sendfile" (Apache/lighttpd)
+    DOCUMENT_SENDFILE = os.environ.get("DOCUMENT_SENDFILE", "").lower()
+    # Interne Nginx-locatie die naar de uploadmap wijst (zie DEPLOY_GUIDE.md)
+    DOCUMENT_ACCEL_PREFIX = os.environ.get("DOCUMENT_ACCEL_PREFIX", "/uploads/documents/")
+    
+    # Gedeelde documentlinks (ondertekend, zonder database) zijn zo lang geldig
+    SHARE_LINK_DAYS = int(os.environ.get("SHARE_LINK_DAYS", 7))
+    SHARE_LINK_MAX_DAYS = int(os.environ.get("SHARE_LINK_MAX_DAYS", 30))
+    
     @classmethod
     def init_app(cls, app):
         # Base configuration init
         pass
     
+    # RDW-opzoekcache (in seconden): gevonden kentekens en kentekens zonder resultaat
+    RDW_CACHE_TTL = int(os.environ.get("RDW_CACHE_TTL", 7 * 24 * 3600))
+    RDW_NEGATIVE_CACHE_TTL = int(os.environ.get("RDW_NEGATIVE_CACHE_TTL", 3600))
+    
     # SendGrid-configuratie voor e-mails (optioneel)
     SENDGRID_API_KEY = os.environ.get("SENDGRID_API_KEY")
     DEFAULT_MAIL_SENDER = os.environ.get("DEFAULT_MAIL_SENDER", "noreply@autoverhuur.nl")
+    
+    # E-mail outbox: "sendgrid" of "memory" (niets versturen, voor ontwikkeling en tests)
+    EMAIL_TRANSPORT = os.environ.get("EMAIL_TRANSPORT", "sendgrid").lower()
+    EMAIL_WORKERS = int(os.environ.get("EMAIL_WORKERS", 4))  # gelijktijdige verzendingen
+    EMAIL_MAX_ATTEMPTS = int(os.environ.get("EMAIL_MAX_ATTEMPTS", 8))
 
 # Ontwikkelconfiguratie
 class DevelopmentConfig(Config):
@@ -35,6 +54,7 @@ class DevelopmentConfig(Config):
 class TestingConfig(Config):
     TESTING = True
     SQLALCHEMY_DATABASE_URI = "sqlite:///:memory:"
+    EMAIL_TRANSPORT = "memory"
     
 # Productieconfiguratie
 class ProductionConfig(Config):
@@ -0,0 +1,104 @@
+import logging
+import os
+from datetime import date
+
+from sqlalchemy import case, desc, func, select
+from sqlalchemy.orm import joinedload
+
+from app import db
+from cache import TTLCache, invalidate_on_write
+from models import Vehicle, Customer, Rental, VehicleExpense
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Short TTL: writes in this worker invalidate immediately, writes in other
+# workers show up at the latest after this many seconds
+DASHBOARD_CACHE_TTL = int(os.environ.get('DASHBOARD_CACHE_TTL', 30))
+
+_dashboard_cache = TTLCache(ttl=DASHBOARD_CACHE_TTL, maxsize=4)
+invalidate_on_write(_dashboard_cache, Vehicle, Customer, Rental, VehicleExpense)
+
+
+def get_dashboard_data():
+    """
+    Get all data shown on the dashboard, cached per process
+
+    Returns:
+        dict: Template context for dashboard.html
+    """
+    today = date.today()
+    # Keyed on the date so due-today/overdue roll over at midnight
+    return _dashboard_cache.get_or_set(today, lambda: _build_dashboard_data(today))
+
+
+def get_cache_stats():
+    """Hit/miss counters of the dashboard cache"""
+    return _dashboard_cache.stats()
+
+
+def _get_counters():
+    """Get the four dashboard counters in a single round trip"""
+    stmt = select(
+        select(func.count(Vehicle.id)).scalar_subquery().label('vehicle_count'),
+        select(
+            func.coalesce(func.sum(case((Vehicle.status == 'available', 1), else_=0)), 0)
+        ).scalar_subquery().label('available_vehicles'),
+        select(func.count(Customer.id)).scalar_subquery().label('customer_count'),
+        select(
+            func.coalesce(func.sum(case((Rental.status == 'active', 1), else_=0)), 0)
+        ).scalar_subquery().label('active_rentals'),
+    )
+    return db.session.execute(stmt).one()._asdict()
+
+
+def _rental_row(rental):
+    """Plain snapshot of a rental with the fields the dashboard panels use"""
+    return {
+        'id': rental.id,
+        'status': rental.status,
+        'end_date': rental.end_date,
+        'customer': {'full_name': rental.customer.full_name},
+        'vehicle': {
+            'make': rental.vehicle.make,
+            'model': rental.vehicle.model,
+            'license_plate': rental.vehicle.license_plate,
+        },
+    }
+
+
+def _build_dashboard_data(today):
+    """Run the dashboard queries; results are plain data so they outlive the session"""
+    rental_query = Rental.query_with_relations()
+
+    recent_rentals = rental_query.order_by(desc(Rental.created_at)).limit(5).all()
+
+    # Due today and overdue come from one query and are split here
+    open_rentals = rental_query.filter(
+        Rental.status == 'active', Rental.end_date <= today
+    ).order_by(Rental.end_date).all()
+
+    recent_expenses = VehicleExpense.query.options(
+        joinedload(VehicleExpense.vehicle)
+    ).order_by(desc(VehicleExpense.created_at)).limit(5).all()
+
+    expenses_by_type = db.session.query(
+        VehicleExpense.expense_type,
+        func.sum(VehicleExpense.amount).label('total')
+    ).group_by(VehicleExpense.expense_type).all()
+
+    data = _get_counters()
+    data.update(
+        recent_rentals=[_rental_row(r) for r in recent_rentals],
+        due_today=[_rental_row(r) for r in open_rentals if r.end_date == today],
+        overdue=[_rental_row(r) for r in open_rentals if r.end_date < today],
+        recent_expenses=[{
+            'date': e.date,
+            'expense_type': e.expense_type,
+            'amount': e.amount,
+            'vehicle': {'license_plate': e.vehicle.license_plate},
+        } for e in recent_expenses],
+        expenses_by_type=[{'expense_type': t, 'total': total} for t, total in expenses_by_type],
+    )
+    logger.debug("Dashboard data rebuilt for %s", today)
+    return data
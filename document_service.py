@@ -1,26 +1,79 @@
 import os
 import shutil
+import hashlib
 import logging
-from datetime import datetime
-from werkzeug.utils import secure_filename
-from models import VehicleDocument, db
+import secrets
+import tempfile
+import time
+from datetime import datetime, timedelta
+from flask import current_app, request, send_file
+from itsdangerous import BadSignature, URLSafeSerializer
+from werkzeug.utils import secure_filename, send_file as werkzeug_send_file
+from models import DocumentUpload, VehicleDocument, db
+import storage
+import thumbnail_service
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Constants
-UPLOAD_FOLDER = os.path.join(os.getcwd(), 'uploads', 'documents')
-ALLOWED_EXTENSIONS = {'pdf', 'png', 'jpg', 'jpeg', 'gif', 'doc', 'docx', 'xls', 'xlsx'}
+# Constants (file locations are resolved by storage.py)
+ALLOWED_EXTENSIONS = {'pdf', 'png', 'jpg', 'jpeg', 'gif', 'doc', 'docx', 'xls', 'xlsx', 'mp4', 'mov'}
+CHUNK_SIZE = 64 * 1024
+
+# Chunked uploads: partial files live in storage.partial_dir() until they are finalized
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024  # suggested to clients, below MAX_CONTENT_LENGTH
+MAX_UPLOAD_SIZE = int(os.environ.get('MAX_DOCUMENT_UPLOAD_SIZE', 2 * 1024 * 1024 * 1024))
+
+
+class UploadError(Exception):
+    """Chunked upload request that cannot be accepted"""
 
 def allowed_file(filename):
     """Check if file has an allowed extension"""
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def store_blob(stream):
+    """
+    Store file contents once under their SHA-256
+    
+    The stream is copied to a temporary file while it is hashed, then
+    renamed to its sharded location (see ``storage.store``). Identical
+    content ends up in the same file, however often it is uploaded.
+    
+    Args:
+        stream: Readable binary file object
+        
+    Returns:
+        str: Storage key of the file
+    """
+    root = storage.upload_root()
+    os.makedirs(root, exist_ok=True)
+    sha256 = hashlib.sha256()
+    fd, tmp_path = tempfile.mkstemp(dir=root, prefix='.upload-')
+    try:
+        with os.fdopen(fd, 'wb') as tmp:
+            for chunk in iter(lambda: stream.read(CHUNK_SIZE), b''):
+                sha256.update(chunk)
+                tmp.write(chunk)
+        key = storage.store(tmp_path, sha256.hexdigest())
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return key
+
+def count_references(filepath):
+    """Number of documents that point to a stored file"""
+    return VehicleDocument.query.filter_by(filepath=filepath).count()
+
 def save_document(vehicle_id, document_type, file, description=None):
     """
     Save a document file and create a database record
     
+    The file is stored content-addressed (see ``store_blob``), so documents
+    with identical contents share one file on disk.
+    
     Args:
         vehicle_id (int): ID of the vehicle
         document_type (str): Type of document
@@ -35,18 +88,8 @@ def save_document(vehicle_id, document_type, file, description=None):
             # Secure the filename
             original_filename = secure_filename(file.filename)
             
-            # Create a unique filename with timestamp
-            timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
-            filename = f"{timestamp}_{original_filename}"
-            
-            # Ensure upload directory exists
-            os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-            
-            # Full path for the file
-            filepath = os.path.join(UPLOAD_FOLDER, filename)
-            
-            # Save the file
-            file.save(filepath)
+            # Stream the file to disk, stored once per unique content
+            filepath = store_blob(file.stream)
             
             # Create database record
             document = VehicleDocument(
@@ -60,6 +103,9 @@ def save_document(vehicle_id, document_type, file, description=None):
             db.session.add(document)
             db.session.commit()
             
+            if document.is_image():
+                thumbnail_service.schedule(storage.resolve(filepath))
+            
             logger.info(f"Document saved: {filepath}")
             return document
         
@@ -80,19 +126,23 @@ def get_document(document_id):
     return VehicleDocument.query.get(document_id)
 
 def delete_document(document_id):
-    """Delete a document and its file"""
+    """
+    Delete a document record
+    
+    The file stays: a document with the same content may be saved at this
+    very moment and reuse it. ``purge_orphaned_files`` removes files that
+    are no longer referenced.
+    """
     try:
         document = get_document(document_id)
         if document:
-            # Delete the file
-            if os.path.exists(document.filepath):
-                os.remove(document.filepath)
+            filepath = document.filepath
             
             # Delete the database record
             db.session.delete(document)
             db.session.commit()
             
-            logger.info(f"Document deleted: {document.filepath}")
+            logger.info(f"Document deleted: {filepath}")
             return True
         
         return False
@@ -102,6 +152,445 @@ def delete_document(document_id):
         db.session.rollback()
         return False
 
+def document_etag(document):
+    """
+    Strong ETag for a document's file
+    
+    Content-addressed files use their SHA-256; older files fall back to
+    size and modification time.
+    """
+    return _etag_for_key(document.filepath)
+
+def _etag_for_key(key):
+    name = os.path.basename(key)
+    if len(name) == 64 and not name.strip('0123456789abcdef'):
+        return name
+    stat = os.stat(storage.resolve(key))
+    return f"{stat.st_size:x}-{stat.st_mtime_ns:x}"
+
+def send_document(document, as_attachment=True):
+    """
+    Build the download response for a document
+    
+    Answers ``If-None-Match`` with 304 and ``Range`` with 206. With
+    ``DOCUMENT_SENDFILE`` set, only headers are returned and the web server
+    sends the file itself.
+    
+    Raises:
+        FileNotFoundError: If the file is missing on disk
+    """
+    response = _send_stored_file(document.filepath, document.filename, document_etag(document), as_attachment)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+def _send_stored_file(key, filename, etag, as_attachment):
+    path = storage.resolve(key)
+    mode = current_app.config.get('DOCUMENT_SENDFILE')
+    
+    if mode in ('x-accel-redirect', 'x-sendfile'):
+        # Headers only; the file itself is never opened by the worker
+        response = werkzeug_send_file(os.path.abspath(path), request.environ,
+                                      download_name=filename, as_attachment=as_attachment,
+                                      use_x_sendfile=True, conditional=False, etag=etag)
+        if mode == 'x-accel-redirect':
+            relpath = storage.relative_path(key)
+            prefix = current_app.config.get('DOCUMENT_ACCEL_PREFIX', '/uploads/documents/')
+            del response.headers['X-Sendfile']
+            response.headers['X-Accel-Redirect'] = prefix.rstrip('/') + '/' + relpath
+        # Ranges are served by the web server; only the 304 check happens here
+        response = response.make_conditional(request)
+        if response.status_code == 304:
+            response.headers.pop('X-Sendfile', None)
+            response.headers.pop('X-Accel-Redirect', None)
+    else:
+        response = send_file(path, download_name=filename,
+                             as_attachment=as_attachment, conditional=True, etag=etag)
+    return response
+
+def _share_serializer():
+    return URLSafeSerializer(current_app.config['SECRET_KEY'], salt='document-share')
+
+def make_share_link(document, days=None):
+    """
+    Create a signed, expiring share token for a document
+    
+    The token carries the storage key and file name, so the shared download
+    needs no database access. It cannot be revoked before it expires, other
+    than by rotating SECRET_KEY.
+    
+    Args:
+        document (VehicleDocument): Document to share
+        days (int): Validity in days, 1 to SHARE_LINK_MAX_DAYS (None for SHARE_LINK_DAYS)
+        
+    Returns:
+        tuple: (token, expiry as a datetime in UTC)
+        
+    Raises:
+        ValueError: If days is outside 1 to SHARE_LINK_MAX_DAYS
+    """
+    if days is None:
+        days = current_app.config['SHARE_LINK_DAYS']
+    max_days = current_app.config['SHARE_LINK_MAX_DAYS']
+    if not 1 <= days <= max_days:
+        raise ValueError(f"Share link validity must be 1 to {max_days} days, got {days}")
+    expires = int(time.time()) + days * 24 * 3600
+    token = _share_serializer().dumps({'k': document.filepath, 'n': document.filename, 'e': expires})
+    return token, datetime.utcfromtimestamp(expires)
+
+def send_shared_file(token):
+    """
+    Build the download response for a share token, without touching the database
+    
+    The response may be cached publicly (by a CDN or reverse proxy) until
+    the link expires.
+    
+    Returns:
+        Response: The file, or None if the token is invalid or expired
+        
+    Raises:
+        FileNotFoundError: If the file is no longer on disk
+    """
+    try:
+        data = _share_serializer().loads(token)
+    except BadSignature:
+        return None
+    remaining = data['e'] - int(time.time())
+    if remaining <= 0:
+        return None
+    
+    key = data['k']
+    response = _send_stored_file(key, data['n'], _etag_for_key(key), as_attachment=True)
+    response.cache_control.no_cache = None
+    response.cache_control.public = True
+    response.cache_control.max_age = remaining
+    response.expires = data['e']
+    return response
+
+def _partial_path(upload):
+    return os.path.join(storage.partial_dir(), upload.id)
+
+def create_upload(vehicle_id, document_type, filename, size, sha256=None, description=None):
+    """
+    Start a chunked upload
+    
+    Args:
+        vehicle_id (int): ID of the vehicle
+        document_type (str): Type of document
+        filename (str): Original file name
+        size (int): Total size in bytes
+        sha256 (str): Optional expected checksum of the whole file
+        description (str): Optional description
+        
+    Returns:
+        DocumentUpload: The new upload, at offset 0
+        
+    Raises:
+        UploadError: If the file type or size is not accepted
+    """
+    filename = secure_filename(filename or '')
+    if not allowed_file(filename):
+        raise UploadError('Niet-toegestaan bestandstype')
+    if not isinstance(size, int) or size <= 0 or size > MAX_UPLOAD_SIZE:
+        raise UploadError('Ongeldige bestandsgrootte')
+    if sha256 is not None and (len(sha256) != 64 or not all(c in '0123456789abcdef' for c in sha256.lower())):
+        raise UploadError('Ongeldige SHA-256')
+    
+    upload = DocumentUpload(
+        id=secrets.token_hex(16),
+        vehicle_id=vehicle_id,
+        document_type=document_type,
+        filename=filename,
+        description=description,
+        size=size,
+        sha256=sha256.lower() if sha256 else None,
+        offset=0,
+    )
+    os.makedirs(storage.partial_dir(), exist_ok=True)
+    open(_partial_path(upload), 'wb').close()
+    db.session.add(upload)
+    db.session.commit()
+    return upload
+
+def get_upload(upload_id, for_update=False):
+    """Get an upload in progress by its ID, optionally locking its row"""
+    return db.session.get(DocumentUpload, upload_id, with_for_update=for_update or None)
+
+def append_chunk(upload, offset, stream, chunk_sha256=None):
+    """
+    Write a chunk at ``offset`` straight into the partial file
+    
+    Only a chunk that starts at the acknowledged offset is accepted. Bytes
+    past that offset from an interrupted earlier attempt are overwritten.
+    With ``chunk_sha256`` the chunk is rejected (and the offset stays put)
+    if its contents do not match.
+    
+    Returns:
+        int: The new acknowledged offset
+        
+    Raises:
+        UploadError: If ``offset`` does not match or the chunk is too large
+    """
+    if offset != upload.offset:
+        raise UploadError(f'Verwachte offset {upload.offset}')
+    
+    written = 0
+    sha256 = hashlib.sha256()
+    with open(_partial_path(upload), 'r+b') as partial:
+        partial.seek(offset)
+        partial.truncate()
+        for chunk in iter(lambda: stream.read(CHUNK_SIZE), b''):
+            written += len(chunk)
+            if offset + written > upload.size:
+                partial.truncate(offset)
+                raise UploadError('Meer gegevens dan de opgegeven bestandsgrootte')
+            sha256.update(chunk)
+            partial.write(chunk)
+        if chunk_sha256 and sha256.hexdigest() != chunk_sha256.lower():
+            partial.truncate(offset)
+            raise UploadError('Checksum van het blok komt niet overeen')
+        partial.flush()
+        os.fsync(partial.fileno())
+    
+    upload.offset = offset + written
+    upload.updated_at = datetime.utcnow()
+    db.session.commit()
+    return upload.offset
+
+def finalize_upload(upload):
+    """
+    Verify a complete upload and turn it into a VehicleDocument
+    
+    The partial file is hard-linked into the content-addressed store (the
+    data is not copied again) and only removed after the document has been
+    committed, so a finalize that fails can simply be retried.
+    
+    Raises:
+        UploadError: If the upload is incomplete or the checksum differs
+    """
+    if upload.offset != upload.size:
+        raise UploadError(f'Upload onvolledig: {upload.offset} van {upload.size} bytes')
+    
+    path = _partial_path(upload)
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as partial:
+        for chunk in iter(lambda: partial.read(1024 * 1024), b''):
+            sha256.update(chunk)
+    digest = sha256.hexdigest()
+    if upload.sha256 and digest != upload.sha256:
+        raise UploadError('Checksum komt niet overeen')
+    
+    filepath = storage.key_for_hash(digest)
+    _link_or_copy(path, storage.resolve(filepath))
+    document = VehicleDocument(
+        vehicle_id=upload.vehicle_id,
+        document_type=upload.document_type,
+        filename=upload.filename,
+        filepath=filepath,
+        description=upload.description,
+    )
+    db.session.add(document)
+    db.session.delete(upload)
+    try:
+        db.session.commit()
+    except Exception:
+        # The partial file and upload are still there for a retry; a stored
+        # file nobody ends up referencing is removed by purge_orphaned_files
+        db.session.rollback()
+        raise
+    os.remove(path)
+    
+    if document.is_image():
+        thumbnail_service.schedule(storage.resolve(filepath))
+    logger.info(f"Chunked upload finalized: {filepath}")
+    return document
+
+def cancel_upload(upload):
+    """Abort an upload and remove its partial file"""
+    path = _partial_path(upload)
+    db.session.delete(upload)
+    db.session.commit()
+    if os.path.exists(path):
+        os.remove(path)
+
+def purge_stale_uploads(max_age_hours=24):
+    """
+    Remove uploads without activity for ``max_age_hours`` and partial files
+    that no longer belong to an upload
+    
+    Returns:
+        int: Number of partial files removed
+    """
+    cutoff = datetime.utcnow() - timedelta(hours=max_age_hours)
+    DocumentUpload.query.filter(DocumentUpload.updated_at < cutoff).delete(synchronize_session=False)
+    db.session.commit()
+    
+    folder = storage.partial_dir()
+    if not os.path.isdir(folder):
+        return 0
+    active = {upload_id for (upload_id,) in db.session.query(DocumentUpload.id)}
+    file_cutoff = time.time() - max_age_hours * 3600
+    removed = 0
+    for entry in os.scandir(folder):
+        # Files of uploads started after the cutoff may not have a committed row yet
+        if entry.name not in active and entry.stat().st_mtime < file_cutoff:
+            os.remove(entry.path)
+            removed += 1
+    return removed
+
+def _untouched_since(path, cutoff):
+    # ctime also changes when a file is renamed into place or hard-linked
+    stat = os.stat(path)
+    return max(stat.st_mtime, stat.st_ctime) < cutoff
+
+def purge_orphaned_files(min_age_hours=24):
+    """
+    Remove stored files that no document refers to, with their thumbnails
+    
+    Only files that were not written, renamed or linked in the last
+    ``min_age_hours`` are considered, so a file that is being stored for a
+    new document is never taken. The references of each candidate are
+    checked again right before it is removed.
+    
+    Returns:
+        int: Number of files removed
+    """
+    root = storage.upload_root()
+    if not os.path.isdir(root):
+        return 0
+    cutoff = time.time() - min_age_hours * 3600
+    referenced = {filepath for (filepath,) in db.session.query(VehicleDocument.filepath).distinct()}
+    removed = 0
+    for folder, subfolders, files in os.walk(root):
+        # Skip .partial and other hidden entries, such as blobs still being written
+        subfolders[:] = [name for name in subfolders if not name.startswith('.')]
+        for name in files:
+            path = os.path.join(folder, name)
+            key = storage.relative_path(path)
+            if name.startswith('.') or '.thumb-' in name or key in referenced or path in referenced:
+                continue
+            try:
+                if not _untouched_since(path, cutoff) or count_references(key) or count_references(path):
+                    continue
+                os.remove(path)
+                thumbnail_service.remove(path)
+            except FileNotFoundError:
+                continue
+            removed += 1
+    logger.info(f"Removed {removed} orphaned document file(s)")
+    return removed
+
+def send_thumbnail(document, size):
+    """
+    Build the response for a document thumbnail
+    
+    Thumbnails never change for a given document, so they may be cached
+    by the browser for a year. Returns None if the thumbnail is not
+    available (yet); it is then scheduled for generation.
+    """
+    original = storage.resolve(document.filepath)
+    path = thumbnail_service.get_thumbnail(original, size)
+    if path is None:
+        if os.path.exists(original):
+            thumbnail_service.schedule(original)
+        return None
+    
+    response = send_file(path, mimetype='image/jpeg', conditional=True,
+                         etag=f"{document_etag(document)}-{size}", max_age=365 * 24 * 3600)
+    response.cache_control.public = None
+    response.cache_control.private = True
+    response.cache_control.immutable = True
+    return response
+
+def _file_sha256(path):
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+def _link_or_copy(source, destination):
+    """Make ``destination`` available without touching ``source``"""
+    if os.path.exists(destination):
+        return
+    os.makedirs(os.path.dirname(destination), exist_ok=True)
+    try:
+        os.link(source, destination)
+    except OSError:
+        # Different file system or no hard links: copy, then rename into place
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(destination), prefix='.migrate-')
+        os.close(fd)
+        try:
+            shutil.copy2(source, tmp_path)
+            os.replace(tmp_path, destination)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+def migrate_storage_layout(batch_size=100):
+    """
+    Move documents stored before the sharded layout into it
+    
+    Works in batches of ``batch_size`` files. Each file is first made
+    available at its new location (hard link or copy, thumbnails
+    included), then all documents that refer to it are updated in one
+    transaction per batch, and only after that commit is the old file
+    removed. Running requests can keep reading either path, and an
+    interrupted run continues where it stopped the next time.
+    
+    Yields:
+        tuple: (migrated files in this batch, list of (old path, error) pairs)
+    """
+    last_id = 0
+    while True:
+        rows = db.session.query(VehicleDocument.id, VehicleDocument.filepath).filter(
+            VehicleDocument.id > last_id
+        ).order_by(VehicleDocument.id).limit(batch_size * 10).all()
+        if not rows:
+            return
+        last_id = rows[-1].id
+        
+        pending = []
+        for filepath in dict.fromkeys(row.filepath for row in rows):
+            if not storage.is_sharded(filepath):
+                pending.append(filepath)
+        
+        for i in range(0, len(pending), batch_size):
+            moved, errors = [], []
+            for old_key in pending[i:i + batch_size]:
+                source = storage.resolve(old_key)
+                try:
+                    name = os.path.basename(source)
+                    sha256 = name if len(name) == 64 and not name.strip('0123456789abcdef') else _file_sha256(source)
+                    new_key = storage.key_for_hash(sha256)
+                    destination = storage.resolve(new_key)
+                    _link_or_copy(source, destination)
+                    for size in thumbnail_service.SIZES:
+                        thumbnail = thumbnail_service.thumbnail_path(source, size)
+                        if os.path.exists(thumbnail):
+                            _link_or_copy(thumbnail, thumbnail_service.thumbnail_path(destination, size))
+                except OSError as e:
+                    errors.append((old_key, str(e)))
+                    continue
+                moved.append((old_key, new_key, source, destination))
+            
+            try:
+                for old_key, new_key, _, _ in moved:
+                    VehicleDocument.query.filter_by(filepath=old_key).update(
+                        {'filepath': new_key}, synchronize_session=False)
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+            
+            for _, _, source, destination in moved:
+                if os.path.abspath(source) != os.path.abspath(destination):
+                    thumbnail_service.remove(source)
+                    if os.path.exists(source):
+                        os.remove(source)
+            yield len(moved), errors
+
 def generate_download_link(document_id, base_url):
     """Generate a download link for a document"""
     return f"{base_url}/documents/download/{document_id}"
\ No newline at end of file
@@ -1,84 +1,321 @@
 import os
+import json
+import time
+import random
 import logging
+import threading
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from sendgrid import SendGridAPIClient
-from sendgrid.helpers.mail import Mail, Attachment, FileContent, FileName, FileType, Disposition, ContentId
+from sendgrid.helpers.mail import (Mail, Attachment, FileContent, FileName, FileType, Disposition, ContentId,
+                                   Personalization, Substitution, To)
 import base64
 from flask import current_app
+from sqlalchemy import and_, func, or_, update
+from app import db
+from models import EmailOutbox
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Outbox states
+PENDING = 'pending'
+SENDING = 'sending'
+SENT = 'sent'
+DEAD = 'dead'
+
+# Retry schedule: 30s, 1m, 2m, ... capped at 1 hour, with jitter
+BACKOFF_BASE = 30
+BACKOFF_MAX = 3600
+# How long a claimed email may stay in 'sending' before another worker takes it over
+SEND_LEASE = timedelta(minutes=10)
+
+
+class TransportError(Exception):
+    """Sending failed; ``permanent`` errors are not retried"""
+
+    def __init__(self, message, permanent=False):
+        super().__init__(message)
+        self.permanent = permanent
+
+
 def send_email(to_email, subject, html_content, attachments=None):
     """
-    Send an email using SendGrid
-    
+    Queue an email for sending
+
+    The email is stored in the outbox and sent by the outbox worker
+    (``flask email-worker``), so the calling request does not wait for
+    SendGrid.
+
     Args:
         to_email (str): Recipient email address
         subject (str): Email subject
         html_content (str): HTML content of the email
         attachments (list): Optional list of file paths to attach
-        
+
     Returns:
-        bool: True if email was sent successfully, False otherwise
+        bool: True if the email was queued, False otherwise
+    """
+    return queue_email([{'email': to_email}], subject, html_content, attachments) is not None
+
+
+def queue_email(recipients, subject, html_content, attachments=None, commit=True):
     """
+    Queue one message for one or more recipients
+
+    Every recipient gets a separate copy (a SendGrid personalization), with
+    its own ``substitutions`` replaced in the subject and content.
+
+    Args:
+        recipients (list): Dicts with ``email`` and optional ``substitutions``
+        subject (str): Email subject
+        html_content (str): HTML content of the email
+        attachments (list): Optional list of file paths to attach
+        commit (bool): Commit right away; pass False to queue the email as
+            part of the caller's transaction
+
+    Returns:
+        EmailOutbox: The queued email, or None if it could not be stored
+    """
+    email = EmailOutbox(
+        subject=subject,
+        html_content=html_content,
+        recipients=json.dumps(recipients),
+        attachments=json.dumps(attachments) if attachments else None,
+        status=PENDING,
+        next_attempt_at=datetime.utcnow(),
+    )
+    if not commit:
+        db.session.add(email)
+        db.session.flush()
+        return email
     try:
-        # Get API key from environment variables
-        api_key = os.environ.get('SENDGRID_API_KEY')
-        
-        if not api_key:
-            logger.error("SendGrid API key not found in environment variables")
-            return False
-        
-        # Set sender email (you might want to configure this)
-        from_email = 'noreply@autoverhuurbeheer.nl'
-        
-        # Create the email message
-        message = Mail(
-            from_email=from_email,
-            to_emails=to_email,
-            subject=subject,
-            html_content=html_content
-        )
-        
-        # Add attachments if provided
-        if attachments:
-            for file_path in attachments:
-                if not os.path.exists(file_path):
-                    logger.warning(f"Attachment file not found: {file_path}")
-                    continue
-                
-                with open(file_path, 'rb') as f:
-                    file_data = f.read()
-                    encoded = base64.b64encode(file_data).decode()
-                
-                # Get the file name and type
-                file_name = os.path.basename(file_path)
-                _, file_ext = os.path.splitext(file_name)
-                file_type = 'application/pdf' if file_ext.lower() == '.pdf' else 'application/octet-stream'
-                
-                # If it's an image, set the appropriate content type
-                if file_ext.lower() in ['.jpg', '.jpeg', '.png', '.gif']:
-                    file_type = f'image/{file_ext[1:].lower()}'
-                
-                # Create attachment
-                attachment = Attachment()
-                attachment.file_content = FileContent(encoded)
-                attachment.file_name = FileName(file_name)
-                attachment.file_type = FileType(file_type)
-                attachment.disposition = Disposition('attachment')
-                attachment.content_id = ContentId(file_name)
-                
-                message.attachment = attachment
-        
-        # Send the email
-        sg = SendGridAPIClient(api_key)
-        response = sg.send(message)
-        
-        # Log the response
-        logger.info(f"Email sent to {to_email}, status code: {response.status_code}")
-        return response.status_code in [200, 201, 202]
-    
+        db.session.add(email)
+        db.session.commit()
+        return email
     except Exception as e:
-        logger.error(f"Error sending email: {str(e)}")
-        return False
\ No newline at end of file
+        logger.error(f"Error queueing email: {str(e)}")
+        db.session.rollback()
+        return None
+
+
+class SendGridTransport:
+    """Sends outbox messages through one shared SendGrid client"""
+
+    def __init__(self, api_key, sender):
+        if not api_key:
+            raise RuntimeError("SendGrid API key not found in configuration")
+        self.client = SendGridAPIClient(api_key)
+        self.sender = sender
+
+    def send(self, message):
+        mail = Mail(from_email=self.sender, subject=message['subject'], html_content=message['html_content'])
+        for recipient in message['recipients']:
+            personalization = Personalization()
+            personalization.add_to(To(recipient['email']))
+            for key, value in (recipient.get('substitutions') or {}).items():
+                personalization.add_substitution(Substitution(key, str(value)))
+            mail.add_personalization(personalization)
+
+        for file_path in message.get('attachments') or []:
+            mail.add_attachment(self._attachment(file_path))
+
+        try:
+            response = self.client.send(mail)
+        except Exception as e:
+            status = getattr(e, 'status_code', None)
+            # 4xx other than rate limiting will fail again the same way
+            permanent = status is not None and 400 <= status < 500 and status != 429
+            raise TransportError(f"SendGrid error {status or ''}: {e}", permanent=permanent) from e
+        if response.status_code not in (200, 201, 202):
+            raise TransportError(f"SendGrid returned status {response.status_code}")
+
+    @staticmethod
+    def _attachment(file_path):
+        if not os.path.exists(file_path):
+            raise TransportError(f"Attachment file not found: {file_path}", permanent=True)
+
+        with open(file_path, 'rb') as f:
+            encoded = base64.b64encode(f.read()).decode()
+
+        # Get the file name and type
+        file_name = os.path.basename(file_path)
+        _, file_ext = os.path.splitext(file_name)
+        file_type = 'application/pdf' if file_ext.lower() == '.pdf' else 'application/octet-stream'
+
+        # If it's an image, set the appropriate content type
+        if file_ext.lower() in ['.jpg', '.jpeg', '.png', '.gif']:
+            file_type = f'image/{file_ext[1:].lower()}'
+
+        attachment = Attachment()
+        attachment.file_content = FileContent(encoded)
+        attachment.file_name = FileName(file_name)
+        attachment.file_type = FileType(file_type)
+        attachment.disposition = Disposition('attachment')
+        attachment.content_id = ContentId(file_name)
+        return attachment
+
+
+class MemoryTransport:
+    """Keeps messages in memory instead of sending them (development and tests)"""
+
+    def __init__(self):
+        self.sent = []
+        self._lock = threading.Lock()
+
+    def send(self, message):
+        with self._lock:
+            self.sent.append(message)
+
+
+def create_transport():
+    """Transport selected by ``EMAIL_TRANSPORT``"""
+    if current_app.config.get('EMAIL_TRANSPORT') == 'memory':
+        return MemoryTransport()
+    return SendGridTransport(current_app.config.get('SENDGRID_API_KEY'),
+                             current_app.config.get('DEFAULT_MAIL_SENDER'))
+
+
+def backoff_delay(attempts):
+    """Seconds to wait before the next attempt after ``attempts`` failures"""
+    delay = min(BACKOFF_BASE * 2 ** (attempts - 1), BACKOFF_MAX)
+    return delay * random.uniform(0.8, 1.2)
+
+
+class OutboxWorker:
+    """
+    Drains the email outbox
+
+    Emails are claimed in batches; several workers (processes) can run side
+    by side because a claim only succeeds for rows that are still due.
+    Sending happens on a thread pool of ``concurrency`` threads, all sharing
+    one transport; the database is only touched from the calling thread.
+    """
+
+    def __init__(self, transport=None, concurrency=None, max_attempts=None):
+        self.transport = transport or create_transport()
+        self.concurrency = concurrency or current_app.config.get('EMAIL_WORKERS', 4)
+        self.max_attempts = max_attempts or current_app.config.get('EMAIL_MAX_ATTEMPTS', 8)
+        self._executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='email')
+        self.started = time.monotonic()
+        self.stats = {'sent': 0, 'retried': 0, 'dead': 0}
+
+    def claim(self, limit):
+        """Mark up to ``limit`` due emails as being sent by this worker"""
+        now = datetime.utcnow()
+        due = or_(EmailOutbox.status == PENDING,
+                  EmailOutbox.status == SENDING)  # SENDING past its lease: the worker died
+        ids = [email_id for (email_id,) in db.session.query(EmailOutbox.id).filter(
+            due, EmailOutbox.next_attempt_at <= now
+        ).order_by(EmailOutbox.next_attempt_at, EmailOutbox.id).limit(limit)]
+
+        claimed = []
+        for email_id in ids:
+            result = db.session.execute(
+                update(EmailOutbox)
+                .where(and_(EmailOutbox.id == email_id, due, EmailOutbox.next_attempt_at <= now))
+                .values(status=SENDING, next_attempt_at=now + SEND_LEASE)
+            )
+            if result.rowcount:
+                claimed.append(email_id)
+        db.session.commit()
+        if not claimed:
+            return []
+        return EmailOutbox.query.filter(EmailOutbox.id.in_(claimed)).all()
+
+    def run_once(self, batch_size=100):
+        """
+        Send one batch of due emails
+
+        Returns:
+            int: Number of emails handled (sent, rescheduled or dead-lettered)
+        """
+        emails = self.claim(batch_size)
+        if not emails:
+            return 0
+
+        futures = {}
+        for email in emails:
+            message = {
+                'subject': email.subject,
+                'html_content': email.html_content,
+                'recipients': json.loads(email.recipients),
+                'attachments': json.loads(email.attachments) if email.attachments else [],
+            }
+            futures[self._executor.submit(self.transport.send, message)] = email
+
+        for future in as_completed(futures):
+            email = futures[future]
+            email.attempts += 1
+            try:
+                future.result()
+            except Exception as e:
+                permanent = isinstance(e, TransportError) and e.permanent
+                email.last_error = str(e)[:2000]
+                if permanent or email.attempts >= self.max_attempts:
+                    email.status = DEAD
+                    self.stats['dead'] += 1
+                    logger.error(f"Email #{email.id} dead-lettered after {email.attempts} attempts: {e}")
+                else:
+                    email.status = PENDING
+                    email.next_attempt_at = datetime.utcnow() + timedelta(seconds=backoff_delay(email.attempts))
+                    self.stats['retried'] += 1
+                    logger.warning(f"Email #{email.id} failed (attempt {email.attempts}), retrying: {e}")
+            else:
+                email.status = SENT
+                email.sent_at = datetime.utcnow()
+                email.last_error = None
+                self.stats['sent'] += 1
+        db.session.commit()
+        return len(emails)
+
+    def run(self, batch_size=100, poll_interval=5.0, stop=None):
+        """Keep sending until ``stop`` (a threading.Event) is set"""
+        stop = stop or threading.Event()
+        while not stop.is_set():
+            try:
+                handled = self.run_once(batch_size)
+            except Exception as e:
+                logger.exception(f"Email outbox worker error: {e}")
+                db.session.rollback()
+                handled = 0
+            finally:
+                # Release the connection between batches
+                db.session.remove()
+            if handled < batch_size:
+                stop.wait(poll_interval)
+
+    def throughput(self):
+        """Emails sent per minute by this worker since it started"""
+        minutes = max(time.monotonic() - self.started, 1) / 60
+        return round(self.stats['sent'] / minutes, 1)
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+
+
+def get_outbox_stats():
+    """Queue depth per status, plus the age of the oldest pending email in seconds"""
+    counts = dict(db.session.query(EmailOutbox.status, func.count()).group_by(EmailOutbox.status).all())
+    oldest = db.session.query(func.min(EmailOutbox.created_at)).filter(
+        EmailOutbox.status.in_([PENDING, SENDING])
+    ).scalar()
+    return {
+        'pending': counts.get(PENDING, 0),
+        'sending': counts.get(SENDING, 0),
+        'sent': counts.get(SENT, 0),
+        'dead': counts.get(DEAD, 0),
+        'oldest_pending_seconds': int((datetime.utcnow() - oldest).total_seconds()) if oldest else 0,
+    }
+
+
+def retry_dead(email_ids=None):
+    """Put dead-lettered emails back in the queue; returns the number requeued"""
+    query = EmailOutbox.query.filter_by(status=DEAD)
+    if email_ids:
+        query = query.filter(EmailOutbox.id.in_(email_ids))
+    count = query.update({'status': PENDING, 'attempts': 0, 'next_attempt_at': datetime.utcnow()},
+                         synchronize_session=False)
+    db.session.commit()
+    return count
@@ -0,0 +1,209 @@
+"""
+Streaming CSV and XLSX exports of rentals, expenses and vehicles.
+
+Rows are read with ``yield_per`` (a server-side cursor on PostgreSQL) and
+written out as they arrive, so memory use does not depend on the number
+of rows. CSV is sent incrementally: the download starts with the first
+batch. XLSX needs the whole workbook before the zip container can be
+closed, so it is written in constant-memory mode to a temporary file
+that is streamed afterwards.
+
+XLSX requires XlsxWriter (``pip install XlsxWriter``); without it only
+CSV is offered.
+"""
+import codecs
+import csv
+import io
+import logging
+import tempfile
+from datetime import date, datetime
+
+from app import db
+from models import Customer, Rental, Vehicle, VehicleExpense
+
+try:
+    import xlsxwriter
+except ImportError:  # pragma: no cover - optional dependency
+    xlsxwriter = None
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+FORMATS = ('csv', 'xlsx')
+MIMETYPES = {
+    'csv': 'text/csv; charset=utf-8',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+}
+# Rows fetched per round trip, and CSV rows per chunk sent to the client
+BATCH_SIZE = 1000
+FILE_CHUNK_SIZE = 64 * 1024
+# Text starting with one of these is taken as a formula by spreadsheet programs
+FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+# Column headers and the selected columns per export, in file order
+RENTAL_COLUMNS = [
+    ('ID', Rental.id),
+    ('Status', Rental.status),
+    ('Startdatum', Rental.start_date),
+    ('Einddatum', Rental.end_date),
+    ('Retourdatum', Rental.actual_return_date),
+    ('Totaalprijs', Rental.total_cost),
+    ('Kenteken', Vehicle.license_plate),
+    ('Merk', Vehicle.make),
+    ('Model', Vehicle.model),
+    ('Klant voornaam', Customer.first_name),
+    ('Klant achternaam', Customer.last_name),
+    ('Klant e-mail', Customer.email),
+    ('Notities', Rental.notes),
+    ('Aangemaakt', Rental.created_at),
+]
+EXPENSE_COLUMNS = [
+    ('ID', VehicleExpense.id),
+    ('Datum', VehicleExpense.date),
+    ('Type', VehicleExpense.expense_type),
+    ('Bedrag', VehicleExpense.amount),
+    ('Kenteken', Vehicle.license_plate),
+    ('Merk', Vehicle.make),
+    ('Model', Vehicle.model),
+    ('Omschrijving', VehicleExpense.description),
+    ('Aangemaakt', VehicleExpense.created_at),
+]
+VEHICLE_COLUMNS = [
+    ('ID', Vehicle.id),
+    ('Kenteken', Vehicle.license_plate),
+    ('Merk', Vehicle.make),
+    ('Model', Vehicle.model),
+    ('Bouwjaar', Vehicle.year),
+    ('Kleur', Vehicle.color),
+    ('Kilometerstand', Vehicle.mileage),
+    ('Dagprijs', Vehicle.daily_rate),
+    ('Status', Vehicle.status),
+    ('Aangemaakt', Vehicle.created_at),
+]
+
+
+def available_formats():
+    """Export formats that can be produced in this environment"""
+    return [fmt for fmt in FORMATS if fmt != 'xlsx' or xlsxwriter is not None]
+
+
+def rental_query():
+    """Rentals with their vehicle and customer, as plain rows ordered by id"""
+    return db.session.query(*[column for _header, column in RENTAL_COLUMNS]).join(
+        Vehicle, Rental.vehicle_id == Vehicle.id
+    ).join(Customer, Rental.customer_id == Customer.id).order_by(Rental.id)
+
+
+def expense_query():
+    """Expenses with their vehicle, as plain rows ordered by date"""
+    return db.session.query(*[column for _header, column in EXPENSE_COLUMNS]).join(
+        Vehicle, VehicleExpense.vehicle_id == Vehicle.id
+    ).order_by(VehicleExpense.date, VehicleExpense.id)
+
+
+def vehicle_query():
+    """Vehicles as plain rows ordered by id"""
+    return db.session.query(*[column for _header, column in VEHICLE_COLUMNS]).order_by(Vehicle.id)
+
+
+def iter_rows(query, batch_size=BATCH_SIZE):
+    """Rows of ``query``, fetched ``batch_size`` at a time"""
+    return query.execution_options(stream_results=True).yield_per(batch_size)
+
+
+def _csv_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, datetime):
+        return value.strftime('%Y-%m-%d %H:%M:%S')
+    if isinstance(value, date):
+        return value.isoformat()
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        # Quote it so Excel shows the text instead of evaluating it
+        return "'" + value
+    return value
+
+
+def stream_csv(headers, rows, batch_size=BATCH_SIZE):
+    """
+    Yield a CSV file in chunks of ``batch_size`` rows
+
+    Starts with a UTF-8 byte order mark so Excel reads accents correctly.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(headers)
+    yield codecs.BOM_UTF8 + buffer.getvalue().encode('utf-8')
+    buffer.seek(0)
+    buffer.truncate()
+
+    for count, row in enumerate(rows, 1):
+        writer.writerow([_csv_value(value) for value in row])
+        if count % batch_size == 0:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+
+
+def stream_xlsx(headers, rows, sheet_name='Export'):
+    """
+    Yield an XLSX file in chunks
+
+    The workbook is written in constant-memory mode (one row in memory at a
+    time) into a temporary file, which is then streamed and removed.
+    """
+    if xlsxwriter is None:
+        raise RuntimeError("XLSX export requires XlsxWriter")
+
+    with tempfile.TemporaryFile() as output:
+        workbook = xlsxwriter.Workbook(output, {'constant_memory': True})
+        worksheet = workbook.add_worksheet(sheet_name)
+        bold = workbook.add_format({'bold': True})
+        date_format = workbook.add_format({'num_format': 'dd-mm-yyyy'})
+        datetime_format = workbook.add_format({'num_format': 'dd-mm-yyyy hh:mm'})
+
+        worksheet.write_row(0, 0, headers, bold)
+        worksheet.freeze_panes(1, 0)
+        for row_index, row in enumerate(rows, 1):
+            for col_index, value in enumerate(row):
+                if value is None:
+                    continue
+                if isinstance(value, datetime):
+                    worksheet.write_datetime(row_index, col_index, value, datetime_format)
+                elif isinstance(value, date):
+                    worksheet.write_datetime(row_index, col_index, value, date_format)
+                elif isinstance(value, str):
+                    # Never as a formula, whatever the text starts with
+                    worksheet.write_string(row_index, col_index, value)
+                else:
+                    worksheet.write_number(row_index, col_index, value)
+        workbook.close()
+
+        output.seek(0)
+        while True:
+            chunk = output.read(FILE_CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+
+
+def stream_export(fmt, columns, query, sheet_name='Export'):
+    """
+    Generator for an export file of ``query``
+
+    Args:
+        fmt (str): 'csv' or 'xlsx'
+        columns (list): (header, column) pairs the query selects
+        query: Query selecting the columns, with filters applied
+        sheet_name (str): Worksheet name for XLSX
+
+    Returns:
+        generator: Chunks of bytes
+    """
+    headers = [header for header, _column in columns]
+    rows = iter_rows(query)
+    if fmt == 'xlsx':
+        return stream_xlsx(headers, rows, sheet_name)
+    return stream_csv(headers, rows)
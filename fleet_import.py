@@ -0,0 +1,147 @@
+"""
+Bulkimport van voertuigen op basis van een lijst kentekens.
+
+De RDW wordt per batch bevraagd (``RDWApi.fetch_many``) en alle nieuwe
+voertuigen gaan met één bulk-INSERT de database in.
+"""
+import csv
+import io
+import logging
+import re
+from dataclasses import dataclass
+
+from sqlalchemy import insert
+
+from app import db
+from models import Vehicle, normalized_plate
+from rdw_api import RDWApi, RDWApiError
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+PLATE_PATTERN = re.compile(r'^[A-Z0-9]{4,8}$')
+PLATE_HEADERS = {'kenteken', 'license_plate', 'plate'}
+
+# Import status per kenteken
+ADDED = 'added'
+EXISTS = 'exists'
+NOT_FOUND = 'not_found'
+INVALID = 'invalid'
+ERROR = 'error'
+
+
+@dataclass
+class PlateResult:
+    """Uitkomst van de import voor één kenteken"""
+    license_plate: str
+    status: str
+    message: str = ''
+
+
+def parse_plates(text):
+    """
+    Lees kentekens uit CSV-inhoud of een geplakte lijst
+
+    Als de eerste regel een kolom ``kenteken`` of ``license_plate`` heeft,
+    wordt alleen die kolom gebruikt; anders telt elke cel als kenteken.
+    Komma's, puntkomma's, tabs en regeleinden scheiden waarden.
+
+    Returns:
+        list: Kentekens zoals ingevoerd, in volgorde, zonder lege waarden
+    """
+    text = text.lstrip('\ufeff')
+    try:
+        dialect = csv.Sniffer().sniff(text[:2048], delimiters=',;\t')
+    except csv.Error:
+        dialect = csv.excel
+    rows = [row for row in csv.reader(io.StringIO(text), dialect) if any(cell.strip() for cell in row)]
+    if not rows:
+        return []
+
+    header = [cell.strip().lower() for cell in rows[0]]
+    for index, name in enumerate(header):
+        if name in PLATE_HEADERS:
+            return [row[index].strip() for row in rows[1:] if len(row) > index and row[index].strip()]
+
+    return [cell.strip() for row in rows for cell in row if cell.strip()]
+
+
+def import_plates(plates, daily_rate, status='available', batch_size=50):
+    """
+    Importeer voertuigen voor een lijst kentekens
+
+    Args:
+        plates (list): Kentekens in willekeurig formaat
+        daily_rate (float): Dagprijs voor alle nieuwe voertuigen
+        status (str): Status voor alle nieuwe voertuigen
+        batch_size (int): Aantal kentekens per RDW-verzoek
+
+    Returns:
+        list: Een PlateResult per ingevoerd kenteken
+    """
+    results = {}
+    order = []
+    seen = set()
+    candidates = []
+    for raw in plates:
+        plate = RDWApi.normalize_plate(raw)
+        if plate in seen:
+            continue
+        seen.add(plate)
+        order.append(plate)
+        if not PLATE_PATTERN.match(plate):
+            results[plate] = PlateResult(raw, INVALID, 'Ongeldig kenteken')
+        else:
+            candidates.append(plate)
+
+    # Kentekens die al in de vloot zitten (ook als ze met streepjes zijn ingevoerd)
+    normalized = normalized_plate(Vehicle.license_plate)
+    existing = set()
+    for i in range(0, len(candidates), 500):
+        chunk = candidates[i:i + 500]
+        existing.update(plate for (plate,) in db.session.query(normalized).filter(normalized.in_(chunk)))
+    for plate in existing:
+        results[plate] = PlateResult(plate, EXISTS, 'Staat al in de vloot')
+    to_fetch = [plate for plate in candidates if plate not in existing]
+
+    try:
+        found = RDWApi.fetch_many(to_fetch, batch_size=batch_size) if to_fetch else {}
+    except RDWApiError as e:
+        logger.error(f"RDW bulkopvraag mislukt: {e}")
+        for plate in to_fetch:
+            results[plate] = PlateResult(plate, ERROR, 'RDW niet bereikbaar')
+        return [results[plate] for plate in order]
+
+    rows = []
+    for plate in to_fetch:
+        data = found.get(plate)
+        if data is None:
+            results[plate] = PlateResult(plate, NOT_FOUND, 'Niet gevonden bij de RDW')
+        elif not data.get('year'):
+            results[plate] = PlateResult(plate, ERROR, 'Geen bouwjaar bekend bij de RDW')
+        else:
+            rows.append({
+                'make': data['make'][:50],
+                'model': data['model'][:50],
+                'year': data['year'],
+                'license_plate': plate,
+                'status': status,
+                'daily_rate': daily_rate,
+                'color': (data.get('color') or '')[:20],
+                'mileage': None,
+            })
+
+    if rows:
+        try:
+            db.session.execute(insert(Vehicle), rows)
+            db.session.commit()
+            for row in rows:
+                results[row['license_plate']] = PlateResult(
+                    row['license_plate'], ADDED, f"{row['make']} {row['model']} ({row['year']})")
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Bulk insert van voertuigen mislukt: {e}")
+            for row in rows:
+                results[row['license_plate']] = PlateResult(row['license_plate'], ERROR, str(e))
+
+    return [results[plate] for plate in order]
@@ -1,5 +1,6 @@
 from app import app  # noqa: F401
 import routes  # noqa: F401
+import cli  # noqa: F401
 
 # Import and register the auth blueprint
 from auth import auth_bp, init_auth
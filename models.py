@@ -1,8 +1,14 @@
 from datetime import datetime
 import os
+import threading
+import time
 from flask_login import UserMixin
+from sqlalchemy import func, inspect, literal, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload
 from werkzeug.security import generate_password_hash, check_password_hash
 from app import db, login_manager
+from cache import TTLCache, on_model_change
 
 class Vehicle(db.Model):
     """Vehicle model for storing car information"""
@@ -20,10 +26,32 @@ class Vehicle(db.Model):
     # Relationship with rentals
     rentals = db.relationship('Rental', backref='vehicle', lazy=True)
     
+    __table_args__ = (
+        db.Index('ix_vehicle_status', 'status'),
+        # Sort orders of the vehicle list; the id makes the keyset unique
+        db.Index('ix_vehicle_make_id', 'make', 'id'),
+        db.Index('ix_vehicle_model_id', 'model', 'id'),
+        db.Index('ix_vehicle_year_id', 'year', 'id'),
+        db.Index('ix_vehicle_daily_rate_id', 'daily_rate', 'id'),
+        db.Index('ix_vehicle_license_plate_id', 'license_plate', 'id'),
+    )
+    
     def __repr__(self):
         return f"{self.year} {self.make} {self.model} ({self.license_plate})"
 
 
+def normalized_plate(column):
+    """SQL version of RDWApi.normalize_plate: no dashes or spaces, upper case"""
+    # Inline literals, not bound parameters, so queries match the index expression
+    dash, space, empty = (literal(value, literal_execute=True) for value in ('-', ' ', ''))
+    return func.upper(func.replace(func.replace(column, dash, empty), space, empty))
+
+
+# Plates are stored as typed ('AB-12-CD' or 'ab12cd'); imports match them on
+# the normalized form, which this expression index answers
+db.Index('ix_vehicle_license_plate_normalized', normalized_plate(Vehicle.license_plate))
+
+
 class Customer(db.Model):
     """Customer model for storing customer information"""
     id = db.Column(db.Integer, primary_key=True)
@@ -46,6 +74,10 @@ class Customer(db.Model):
         return f"{self.first_name} {self.last_name}"
 
 
+# Case-insensitive e-mail lookups (bulk import) use this expression index
+db.Index('ix_customer_email_lower', func.lower(Customer.email))
+
+
 class Rental(db.Model):
     """Rental model for storing rental information"""
     id = db.Column(db.Integer, primary_key=True)
@@ -59,8 +91,30 @@ class Rental(db.Model):
     notes = db.Column(db.Text)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
+    __table_args__ = (
+        # Overdue / due today: status = 'active' AND end_date <op> today
+        db.Index('ix_rental_status_end_date', 'status', 'end_date'),
+        # Revenue report: status IN (...) AND start_date BETWEEN ...
+        db.Index('ix_rental_status_start_date', 'status', 'start_date'),
+        # Active rental checks before deleting a vehicle or customer
+        db.Index('ix_rental_vehicle_id_status', 'vehicle_id', 'status'),
+        db.Index('ix_rental_customer_id_status', 'customer_id', 'status'),
+        # Availability: vehicle_id = ? AND start_date <= D2 AND end_date >= D1
+        db.Index('ix_rental_vehicle_id_start_date_end_date', 'vehicle_id', 'start_date', 'end_date'),
+        # Recent rentals on the dashboard
+        db.Index('ix_rental_created_at', 'created_at'),
+        # Sort orders and the date range filter of the rental list
+        db.Index('ix_rental_start_date_id', 'start_date', 'id'),
+        db.Index('ix_rental_end_date_id', 'end_date', 'id'),
+    )
+    
     def __repr__(self):
         return f"Rental #{self.id}: {self.vehicle.license_plate} to {self.customer.full_name}"
+    
+    @classmethod
+    def query_with_relations(cls):
+        """Rental query that loads vehicle and customer in the same SELECT"""
+        return cls.query.options(joinedload(cls.vehicle), joinedload(cls.customer))
 
 
 class VehicleExpense(db.Model):
@@ -76,6 +130,15 @@ class VehicleExpense(db.Model):
     # Relationship with vehicle
     vehicle = db.relationship('Vehicle', backref='expenses', lazy=True)
     
+    __table_args__ = (
+        # Expense list of a vehicle, newest first
+        db.Index('ix_vehicle_expense_vehicle_id_date', 'vehicle_id', 'date'),
+        # Recent expenses on the dashboard
+        db.Index('ix_vehicle_expense_created_at', 'created_at'),
+        # Covers the totals per expense type on the dashboard
+        db.Index('ix_vehicle_expense_type_amount', 'expense_type', 'amount'),
+    )
+    
     def __repr__(self):
         return f"Expense #{self.id}: {self.expense_type} for {self.vehicle.license_plate} - €{self.amount}"
 
@@ -93,6 +156,12 @@ class VehicleDocument(db.Model):
     # Relationship with vehicle
     vehicle = db.relationship('Vehicle', backref='documents', lazy=True)
     
+    __table_args__ = (
+        db.Index('ix_vehicle_document_vehicle_id', 'vehicle_id'),
+        # Reference counting of content-addressed files
+        db.Index('ix_vehicle_document_filepath', 'filepath'),
+    )
+    
     def __repr__(self):
         return f"Document #{self.id}: {self.document_type} for {self.vehicle.license_plate}"
         
@@ -109,6 +178,200 @@ class VehicleDocument(db.Model):
     def is_pdf(self):
         """Check if the document is a PDF"""
         return self.get_file_extension() == '.pdf'
+    
+    @property
+    def content_hash(self):
+        """SHA-256 of the file contents, or None for files stored before deduplication"""
+        name = os.path.basename(self.filepath)
+        if len(name) == 64 and all(c in '0123456789abcdef' for c in name):
+            return name
+        return None
+
+
+class DocumentUpload(db.Model):
+    """Chunked upload in progress; becomes a VehicleDocument when finalized"""
+    __tablename__ = 'document_upload'
+    id = db.Column(db.String(32), primary_key=True)  # random token, also the partial file name
+    vehicle_id = db.Column(db.Integer, db.ForeignKey('vehicle.id'), nullable=False)
+    document_type = db.Column(db.String(50), nullable=False)
+    filename = db.Column(db.String(255), nullable=False)
+    description = db.Column(db.Text)
+    size = db.Column(db.BigInteger, nullable=False)  # total size announced by the client
+    sha256 = db.Column(db.String(64))  # expected checksum, verified on finalize
+    offset = db.Column(db.BigInteger, nullable=False, default=0)  # bytes received so far
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    
+    def __repr__(self):
+        return f"Upload {self.id}: {self.filename} ({self.offset}/{self.size})"
+
+
+class EmailOutbox(db.Model):
+    """Queued email, sent by the outbox worker (see email_service.py)"""
+    __tablename__ = 'email_outbox'
+    id = db.Column(db.Integer, primary_key=True)
+    subject = db.Column(db.String(255), nullable=False)
+    html_content = db.Column(db.Text, nullable=False)
+    recipients = db.Column(db.Text, nullable=False)  # JSON: [{"email": ..., "substitutions": {...}}]
+    attachments = db.Column(db.Text)  # JSON list of file paths, read when sending
+    status = db.Column(db.String(20), nullable=False, default='pending')  # pending, sending, sent, dead
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)  # also the lease while sending
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    sent_at = db.Column(db.DateTime)
+    
+    __table_args__ = (
+        db.Index('ix_email_outbox_status_next_attempt', 'status', 'next_attempt_at'),
+    )
+    
+    def __repr__(self):
+        return f"Email #{self.id}: {self.subject} ({self.status})"
+
+
+class RentalReminder(db.Model):
+    """Reminder email queued for a rental, so a rerun does not send it twice"""
+    __tablename__ = 'rental_reminder'
+    id = db.Column(db.Integer, primary_key=True)
+    rental_id = db.Column(db.Integer, db.ForeignKey('rental.id'), nullable=False)
+    kind = db.Column(db.String(20), nullable=False)  # due_today, overdue
+    reminder_date = db.Column(db.Date, nullable=False)
+    email_id = db.Column(db.Integer, db.ForeignKey('email_outbox.id'))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        db.UniqueConstraint('rental_id', 'kind', 'reminder_date', name='uq_rental_reminder'),
+    )
+    
+    def __repr__(self):
+        return f"Reminder {self.kind} for rental #{self.rental_id} on {self.reminder_date}"
+
+
+class AuthVersion(db.Model):
+    """Counter bumped on every user, role or permission change, shared by all workers"""
+    __tablename__ = 'auth_version'
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+
+# Effective roles/permissions per user, keyed on (permission version, user id).
+# Bumping the version makes every cached set unreachable in this process;
+# other processes see the shared AuthVersion change and drop theirs within
+# AUTH_VERSION_CHECK_INTERVAL seconds.
+PERMISSION_CACHE_TTL = int(os.environ.get('PERMISSION_CACHE_TTL', 60))
+AUTH_VERSION_CHECK_INTERVAL = float(os.environ.get('AUTH_VERSION_CHECK_INTERVAL', 5))
+_access_cache = TTLCache(ttl=PERMISSION_CACHE_TTL, maxsize=1024)
+_permission_version = 0
+# Last shared AuthVersion seen by this process, and when it was read
+_shared_version = None
+_shared_version_checked_at = float('-inf')
+_shared_version_lock = threading.Lock()
+
+
+def _clear_auth_caches():
+    global _permission_version
+    _permission_version += 1
+    _access_cache.clear()
+    _user_cache.clear()
+
+
+def bump_permission_version():
+    """
+    Invalidate cached users and permission sets after users, roles or
+    permissions change, in this process right away and in the others at
+    their next version check
+    
+    Call it after the change has been committed; it commits the new
+    shared version itself.
+    """
+    _clear_auth_caches()
+    try:
+        bumped = db.session.execute(
+            update(AuthVersion).where(AuthVersion.id == 1).values(version=AuthVersion.version + 1)
+        ).rowcount
+        if not bumped:
+            db.session.add(AuthVersion(id=1, version=1))
+        db.session.commit()
+    except IntegrityError:
+        # Another process created the row at the same moment; count on that one
+        db.session.rollback()
+        db.session.execute(
+            update(AuthVersion).where(AuthVersion.id == 1).values(version=AuthVersion.version + 1))
+        db.session.commit()
+
+
+def sync_auth_version():
+    """
+    Drop cached users and permission sets when another process bumped the
+    shared version; reads it at most every AUTH_VERSION_CHECK_INTERVAL seconds
+    """
+    global _shared_version, _shared_version_checked_at
+    now = time.monotonic()
+    if now - _shared_version_checked_at < AUTH_VERSION_CHECK_INTERVAL:
+        return
+    with _shared_version_lock:
+        if now - _shared_version_checked_at < AUTH_VERSION_CHECK_INTERVAL:
+            return
+        version = db.session.query(AuthVersion.version).filter(AuthVersion.id == 1).scalar() or 0
+        if _shared_version is not None and version != _shared_version:
+            _clear_auth_caches()
+        _shared_version = version
+        _shared_version_checked_at = now
+
+
+def get_user_access(user_id):
+    """Cached (role names, permission names) frozensets of a user"""
+    key = (_permission_version, user_id)
+    return _access_cache.get_or_set(key, lambda: _load_user_access(user_id))
+
+
+def _load_user_access(user_id):
+    """Load role and permission names of a user in a single query"""
+    rows = db.session.query(Role.name, Permission.name).select_from(user_roles).join(
+        Role, Role.id == user_roles.c.role_id
+    ).outerjoin(
+        role_permissions, role_permissions.c.role_id == Role.id
+    ).outerjoin(
+        Permission, Permission.id == role_permissions.c.permission_id
+    ).filter(user_roles.c.user_id == user_id).all()
+    
+    roles = frozenset(role for role, _ in rows)
+    permissions = frozenset(perm for _, perm in rows if perm is not None)
+    return roles, permissions
+
+
+class RDWLookupCache(db.Model):
+    """Cached RDW lookups by normalized license plate, shared by all workers"""
+    __tablename__ = 'rdw_lookup_cache'
+    license_plate = db.Column(db.String(20), primary_key=True)
+    data = db.Column(db.Text)  # JSON of RDWApi._format_vehicle_data, NULL if the plate was not found
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f"RDW cache {self.license_plate} (until {self.expires_at})"
+
+
+class RDWMirrorVehicle(db.Model):
+    """Local copy of the RDW 'Gekentekende voertuigen' dataset (m9d7-ebf2)"""
+    __tablename__ = 'rdw_mirror_vehicle'
+    kenteken = db.Column(db.String(20), primary_key=True)
+    data = db.Column(db.Text, nullable=False)  # JSON of the CSV row with API field names
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f"RDW mirror {self.kenteken}"
+
+
+class RDWMirrorFuel(db.Model):
+    """Local copy of the RDW 'brandstof' dataset (8ys7-d773), first fuel per plate"""
+    __tablename__ = 'rdw_mirror_fuel'
+    kenteken = db.Column(db.String(20), primary_key=True)
+    data = db.Column(db.Text, nullable=False)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f"RDW mirror fuel {self.kenteken}"
 
 
 # Define a many-to-many relationship for User and Role
@@ -131,7 +394,7 @@ class User(UserMixin, db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     # Relationship with roles
-    roles = db.relationship('Role', secondary=user_roles, lazy='subquery',
+    roles = db.relationship('Role', secondary=user_roles, lazy='select',
                            backref=db.backref('users', lazy=True))
     
     def __repr__(self):
@@ -152,16 +415,27 @@ class User(UserMixin, db.Model):
             return f"{self.first_name} {self.last_name}"
         return self.username
     
+    def get_access(self):
+        """
+        Get the user's role and permission names as frozensets
+        
+        The flattened sets are cached per process under the current
+        permission version, so checks after the first one need no SQL.
+        """
+        if self.id is None:
+            # Not flushed yet: use the in-memory relationships
+            roles = frozenset(role.name for role in self.roles)
+            permissions = frozenset(perm.name for role in self.roles for perm in role.permissions)
+            return roles, permissions
+        return get_user_access(self.id)
+    
     def has_role(self, role_name):
         """Check if user has a specific role"""
-        return any(role.name == role_name for role in self.roles)
+        return role_name in self.get_access()[0]
     
     def has_permission(self, permission_name):
         """Check if user has a specific permission through any of their roles"""
-        for role in self.roles:
-            if any(perm.name == permission_name for perm in role.permissions):
-                return True
-        return False
+        return permission_name in self.get_access()[1]
 
 
 class Role(db.Model):
@@ -171,7 +445,7 @@ class Role(db.Model):
     description = db.Column(db.String(255))
     
     # Relationship with permissions
-    permissions = db.relationship('Permission', secondary='role_permissions', lazy='subquery',
+    permissions = db.relationship('Permission', secondary='role_permissions', lazy='select',
                                  backref=db.backref('roles', lazy=True))
     
     def __repr__(self):
@@ -195,8 +469,76 @@ role_permissions = db.Table('role_permissions',
 )
 
 
+class UserSnapshot(UserMixin):
+    """
+    Read-only, session-independent copy of a User for ``current_user``
+    
+    Holds only the columns the pages use; role and permission checks go
+    through the shared permission cache.
+    """
+    
+    def __init__(self, user):
+        for name in ('id', 'username', 'email', 'first_name', 'last_name'):
+            object.__setattr__(self, name, getattr(user, name))
+        object.__setattr__(self, '_is_active', bool(user.is_active))
+    
+    def __setattr__(self, name, value):
+        raise AttributeError(f"UserSnapshot is read-only, load the User model to change '{name}'")
+    
+    def __repr__(self):
+        return f"User {self.username}"
+    
+    @property
+    def is_active(self):
+        return self._is_active
+    
+    full_name = User.full_name
+    has_role = User.has_role
+    has_permission = User.has_permission
+    
+    def get_access(self):
+        return get_user_access(self.id)
+
+
+# Snapshots for the user loader, so an authenticated request skips the user SELECT
+USER_CACHE_TTL = int(os.environ.get('USER_CACHE_TTL', 300))
+USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE', 1000))
+_user_cache = TTLCache(ttl=USER_CACHE_TTL, maxsize=USER_CACHE_SIZE)
+
+
+@on_model_change(User)
+def _invalidate_user_snapshots(users):
+    """Drop snapshots of users whose row or roles were written"""
+    if users is None:
+        _user_cache.clear()
+        return
+    for user in users:
+        identity = inspect(user).identity
+        if identity:
+            _user_cache.invalidate(identity[0])
+
+
+def get_auth_cache_stats():
+    """Hit/miss counters of the user snapshot and permission caches"""
+    return {
+        'users': _user_cache.stats(),
+        'permissions': _access_cache.stats(),
+        'permission_version': _permission_version,
+        'shared_version': _shared_version,
+    }
+
+
 # Setup Flask-Login
 @login_manager.user_loader
 def load_user(user_id):
     """Load a user by ID for Flask-Login"""
-    return User.query.get(int(user_id))
+    user_id = int(user_id)
+    sync_auth_version()
+    snapshot = _user_cache.get(user_id)
+    if snapshot is None:
+        user = db.session.get(User, user_id)
+        if user is None:
+            return None
+        snapshot = UserSnapshot(user)
+        _user_cache.set(user_id, snapshot)
+    return snapshot
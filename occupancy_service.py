@@ -0,0 +1,240 @@
+"""
+Fleet occupancy matrix: which vehicles are out on which days.
+
+Every vehicle's occupancy over the requested range is one Python integer
+used as a bitset, bit ``i`` set when the vehicle is booked on day ``i``.
+The matrix comes from a single range query; utilization is a popcount
+per row. NumPy would add a dependency for no gain at this size: a 90-day
+row is two machine words.
+
+Matrices are cached per range. A committed change to a rental or vehicle
+does not throw them away; the ids are queued and the affected rows are
+patched with one small query per model the next time a matrix is read.
+"""
+import logging
+import os
+import threading
+from collections import defaultdict
+from datetime import date, timedelta
+
+from sqlalchemy import and_, inspect
+
+from app import db
+import availability_service
+from cache import TTLCache, on_model_change
+from models import Rental, Vehicle
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+OCCUPANCY_CACHE_TTL = int(os.environ.get('OCCUPANCY_CACHE_TTL', 300))
+DEFAULT_DAYS = 90
+MAX_DAYS = 366
+
+_occupancy_cache = TTLCache(ttl=OCCUPANCY_CACHE_TTL, maxsize=16)
+
+# Ids written since the cached matrices were last patched, per model
+_pending = {Rental: set(), Vehicle: set()}
+_pending_lock = threading.Lock()
+
+
+@on_model_change(Rental, Vehicle)
+def _queue_changes(instances):
+    """Remember changed rows; bulk statements do not say which, so start over"""
+    if instances is None:
+        _occupancy_cache.clear()
+        return
+    with _pending_lock:
+        for instance in instances:
+            identity = inspect(instance).identity
+            if identity:
+                _pending[type(instance)].add(identity[0])
+
+
+class OccupancyMatrix:
+    """Per-vehicle day bitsets for ``days`` days starting at ``start_date``"""
+
+    def __init__(self, start_date, days, vehicles):
+        self.start_date = start_date
+        self.days = days
+        # Row order and labels: dicts with id, license_plate, make, model, status
+        self.vehicles = vehicles
+        self.rows = {vehicle['id']: 0 for vehicle in vehicles}
+        # rental id -> (vehicle id, mask); kept so a changed rental can be taken out again
+        self.rentals = {}
+        self._vehicle_rentals = defaultdict(set)
+        self._lock = threading.Lock()
+
+    @property
+    def end_date(self):
+        return self.start_date + timedelta(days=self.days - 1)
+
+    def mask(self, start_date, end_date):
+        """Bits of the days from ``start_date`` to ``end_date`` inside the range"""
+        first = max((start_date - self.start_date).days, 0)
+        last = min((end_date - self.start_date).days, self.days - 1)
+        if last < first:
+            return 0
+        return ((1 << (last - first + 1)) - 1) << first
+
+    def add_rental(self, rental_id, vehicle_id, start_date, end_date):
+        mask = self.mask(start_date, end_date)
+        if not mask or vehicle_id not in self.rows:
+            return
+        self.rentals[rental_id] = (vehicle_id, mask)
+        self._vehicle_rentals[vehicle_id].add(rental_id)
+        self.rows[vehicle_id] |= mask
+
+    def remove_rental(self, rental_id):
+        entry = self.rentals.pop(rental_id, None)
+        if entry is None:
+            return
+        vehicle_id = entry[0]
+        self._vehicle_rentals[vehicle_id].discard(rental_id)
+        # Rentals of one vehicle may overlap in old data, so rebuild the row
+        row = 0
+        for other_id in self._vehicle_rentals[vehicle_id]:
+            row |= self.rentals[other_id][1]
+        self.rows[vehicle_id] = row
+
+    def patch(self, changed):
+        """
+        Bring the matrix up to date with changed rentals
+
+        Args:
+            changed (dict): rental id -> (vehicle_id, start, end), or None
+                for rentals that no longer block their vehicle
+        """
+        with self._lock:
+            for rental_id, booking in changed.items():
+                self.remove_rental(rental_id)
+                if booking is not None:
+                    self.add_rental(rental_id, *booking)
+
+    def utilization(self, vehicle_id):
+        """Share of the days the vehicle is booked, 0.0 - 1.0"""
+        return self.rows[vehicle_id].bit_count() / self.days
+
+    def fleet_utilization(self):
+        """Share of all vehicle-days that are booked"""
+        if not self.rows:
+            return 0.0
+        return sum(row.bit_count() for row in self.rows.values()) / (self.days * len(self.rows))
+
+    def occupied_per_day(self):
+        """Number of vehicles out on each day of the range"""
+        counts = [0] * self.days
+        for row in self.rows.values():
+            while row:
+                lowest = row & -row
+                counts[lowest.bit_length() - 1] += 1
+                row ^= lowest
+        return counts
+
+    def row_string(self, vehicle_id):
+        """Row as a string of '0'/'1', first day first"""
+        return format(self.rows[vehicle_id], f'0{self.days}b')[::-1]
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                'start_date': self.start_date.isoformat(),
+                'end_date': self.end_date.isoformat(),
+                'days': self.days,
+                'vehicles': [{
+                    **vehicle,
+                    'occupied': self.row_string(vehicle['id']),
+                    'utilization': round(self.utilization(vehicle['id']) * 100, 1),
+                } for vehicle in self.vehicles],
+                'occupied_per_day': self.occupied_per_day(),
+                'fleet_utilization': round(self.fleet_utilization() * 100, 1),
+            }
+
+
+def build_matrix(start_date, days):
+    """Build the matrix for a range from one vehicles-left-join-rentals query"""
+    end_date = start_date + timedelta(days=days - 1)
+    rows = db.session.query(
+        Vehicle.id, Vehicle.license_plate, Vehicle.make, Vehicle.model, Vehicle.status,
+        Rental.id, Rental.start_date, Rental.end_date,
+    ).outerjoin(Rental, and_(
+        Rental.vehicle_id == Vehicle.id,
+        availability_service.overlap_condition(start_date, end_date),
+    )).order_by(Vehicle.license_plate, Vehicle.id).all()
+
+    vehicles = []
+    bookings = []
+    seen = set()
+    for vehicle_id, license_plate, make, model, status, rental_id, rental_start, rental_end in rows:
+        if vehicle_id not in seen:
+            seen.add(vehicle_id)
+            vehicles.append({'id': vehicle_id, 'license_plate': license_plate,
+                             'make': make, 'model': model, 'status': status})
+        if rental_id is not None:
+            bookings.append((rental_id, vehicle_id, rental_start, rental_end))
+
+    matrix = OccupancyMatrix(start_date, days, vehicles)
+    for booking in bookings:
+        matrix.add_rental(*booking)
+    return matrix
+
+
+def _apply_pending_changes():
+    """Patch every cached matrix with the rentals and vehicles written since the last read"""
+    with _pending_lock:
+        rental_ids = list(_pending[Rental])
+        vehicle_ids = list(_pending[Vehicle])
+        _pending[Rental].clear()
+        _pending[Vehicle].clear()
+    matrices = _occupancy_cache.items()
+    if not matrices or not (rental_ids or vehicle_ids):
+        return
+
+    if vehicle_ids:
+        vehicles = {vehicle_id: {'id': vehicle_id, 'license_plate': license_plate,
+                                 'make': make, 'model': model, 'status': status}
+                    for vehicle_id, license_plate, make, model, status in db.session.query(
+                        Vehicle.id, Vehicle.license_plate, Vehicle.make, Vehicle.model, Vehicle.status
+                    ).filter(Vehicle.id.in_(vehicle_ids))}
+        for key, matrix in matrices:
+            labels = {vehicle['id']: vehicle for vehicle in matrix.vehicles}
+            # Added or removed vehicles and new plates change the rows or their order
+            if any(vehicle_id not in labels or vehicle_id not in vehicles
+                   or labels[vehicle_id]['license_plate'] != vehicles[vehicle_id]['license_plate']
+                   for vehicle_id in vehicle_ids):
+                _occupancy_cache.invalidate(key)
+                continue
+            for vehicle_id in vehicle_ids:
+                labels[vehicle_id].update(vehicles[vehicle_id])
+
+    if rental_ids:
+        blocking = {
+            rental_id: (vehicle_id, start, end)
+            for rental_id, vehicle_id, start, end, status in db.session.query(
+                Rental.id, Rental.vehicle_id, Rental.start_date, Rental.end_date, Rental.status
+            ).filter(Rental.id.in_(rental_ids))
+            if status in availability_service.BLOCKING_STATUSES
+        }
+        # Deleted, cancelled and completed rentals map to None and are taken out
+        changed = {rental_id: blocking.get(rental_id) for rental_id in rental_ids}
+        for _key, matrix in _occupancy_cache.items():
+            matrix.patch(changed)
+    logger.debug(f"Patched occupancy matrices with {len(rental_ids)} rental(s), {len(vehicle_ids)} vehicle(s)")
+
+
+def get_occupancy(start_date=None, days=DEFAULT_DAYS):
+    """
+    Occupancy matrix for ``days`` days from ``start_date`` (default: today)
+
+    Returns:
+        OccupancyMatrix: Cached per range and patched with recent rental changes
+    """
+    start_date = start_date or date.today()
+    days = max(1, min(days, MAX_DAYS))
+    _apply_pending_changes()
+    return _occupancy_cache.get_or_set((start_date, days), lambda: build_matrix(start_date, days))
+
+
+def get_cache_stats():
+    """Hit/miss counters of the occupancy cache"""
+    return _occupancy_cache.stats()
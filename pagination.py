@@ -0,0 +1,160 @@
+"""
+Keyset (seek) pagination helpers for the list pages.
+
+Instead of OFFSET, each page remembers the sort key of its last row in an
+opaque cursor. The next page continues with ``WHERE (sort, id) > cursor``,
+so page N costs the same index seek as page 1.
+"""
+import base64
+import json
+from dataclasses import dataclass
+from datetime import date, datetime
+
+from sqlalchemy import and_, or_
+
+DEFAULT_PER_PAGE = 25
+MAX_PER_PAGE = 100
+
+
+@dataclass
+class KeysetPage:
+    """One page of results plus the cursor for the page after it"""
+    items: list
+    next_cursor: str = None
+    per_page: int = DEFAULT_PER_PAGE
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+
+def _to_json(value):
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    return value
+
+
+def _from_json(value, column):
+    if value is None:
+        return None
+    try:
+        python_type = column.type.python_type
+    except NotImplementedError:
+        return value
+    if python_type is datetime:
+        return datetime.fromisoformat(value)
+    if python_type is date:
+        return date.fromisoformat(value)
+    return python_type(value)
+
+
+def encode_cursor(values):
+    """Encode the sort key values of a row as a URL-safe cursor"""
+    raw = json.dumps([_to_json(v) for v in values], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, columns):
+    """
+    Decode a cursor back into typed sort key values
+
+    Returns:
+        list: One value per column, or None if the cursor is missing or invalid
+    """
+    if not cursor:
+        return None
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if not isinstance(values, list) or len(values) != len(columns):
+            return None
+        return [_from_json(v, c) for v, c in zip(values, columns)]
+    except (ValueError, TypeError):
+        return None
+
+
+def _seek_condition(columns, values, descending):
+    """Build ``(c1, c2, ...) > (v1, v2, ...)`` as portable OR/AND terms"""
+    terms = []
+    for i, column in enumerate(columns):
+        equal_prefix = [columns[j] == values[j] for j in range(i)]
+        step = column < values[i] if descending else column > values[i]
+        terms.append(and_(*equal_prefix, step))
+    return or_(*terms)
+
+
+def parse_sort(value, sort_columns, primary_key, default='id'):
+    """
+    Parse a ``sort=make`` / ``sort=-year`` query parameter
+
+    Args:
+        value (str): Raw query parameter, a leading ``-`` means descending
+        sort_columns (dict): Allowed sort keys mapped to columns
+        primary_key: Column appended as tie-breaker so the sort key is unique
+        default (str): Sort used when ``value`` is missing or not allowed
+
+    Returns:
+        tuple: (normalized sort value, list of columns, descending)
+    """
+    value = value or default
+    key = value.lstrip('-')
+    if key not in sort_columns:
+        value = default
+        key = value.lstrip('-')
+    descending = value.startswith('-')
+
+    columns = [sort_columns[key]]
+    if sort_columns[key] is not primary_key:
+        columns.append(primary_key)
+    return value, columns, descending
+
+
+def parse_per_page(value, default=DEFAULT_PER_PAGE):
+    """Parse a per_page query parameter, clamped to a sane range"""
+    try:
+        per_page = int(value)
+    except (TypeError, ValueError):
+        return default
+    return max(1, min(per_page, MAX_PER_PAGE))
+
+
+def link_params(args, keys):
+    """
+    Query parameters to carry over into page links
+
+    Only ``keys`` are kept: the result is passed to ``url_for`` as keyword
+    arguments, where names like ``endpoint``, ``_external`` or ``format``
+    would otherwise change or break the generated URL.
+    """
+    return {key: args[key] for key in keys if args.get(key)}
+
+
+def keyset_paginate(query, columns, cursor=None, per_page=DEFAULT_PER_PAGE, descending=False):
+    """
+    Fetch one page of ``query`` ordered by ``columns``
+
+    Args:
+        query: SQLAlchemy query with filters already applied
+        columns (list): Sort columns; the last one must be unique (usually the primary key)
+        cursor (str): Cursor from the previous page, or None for the first page
+        per_page (int): Page size
+        descending (bool): Sort direction for all columns
+
+    Returns:
+        KeysetPage: The rows of this page and the cursor for the next one
+    """
+    values = decode_cursor(cursor, columns)
+    if values is not None:
+        query = query.filter(_seek_condition(columns, values, descending))
+
+    order = [c.desc() if descending else c.asc() for c in columns]
+    # Fetch one extra row to find out whether there is a next page
+    rows = query.order_by(*order).limit(per_page + 1).all()
+
+    next_cursor = None
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        last = rows[-1]
+        next_cursor = encode_cursor([getattr(last, c.key) for c in columns])
+
+    return KeysetPage(items=rows, next_cursor=next_cursor, per_page=per_page)
@@ -1,17 +1,281 @@
-import requests
+import os
+import threading
 import logging
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+
+class RDWApiError(Exception):
+    """Fout bij het bereiken van de RDW API (timeout, verbindingsfout, HTTP-fout)"""
+
+
+class SingleFlight:
+    """
+    Laat gelijktijdige aanroepen met dezelfde sleutel één keer uitvoeren
+    
+    De eerste aanroep voert de functie uit; aanroepen die binnenkomen
+    terwijl die nog loopt wachten op hetzelfde resultaat (of dezelfde
+    exceptie) in plaats van zelf een verzoek te doen.
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.executed = 0
+        self.coalesced = 0
+    
+    def do(self, key, fn, *args):
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._calls[key] = future
+                self.executed += 1
+            else:
+                self.coalesced += 1
+        
+        if leader:
+            try:
+                future.set_result(fn(*args))
+            except BaseException as e:
+                future.set_exception(e)
+            finally:
+                with self._lock:
+                    del self._calls[key]
+        
+        return future.result()
+
+
 class RDWApi:
     """
     Klasse voor communicatie met de RDW Open Data API voor voertuiggegevens
+    
+    Alle verzoeken gaan via één gedeelde sessie met connection pooling en
+    begrensde timeouts. Voertuig- en brandstofgegevens worden parallel
+    opgevraagd. Zet ``RDW_BASE_URL`` om tegen een lokale stand-in te testen.
     """
     
-    BASE_URL_VEHICLES = "https://opendata.rdw.nl/resource/m9d7-ebf2.json"
-    BASE_URL_FUEL = "https://opendata.rdw.nl/resource/8ys7-d773.json"
+    BASE_URL = os.environ.get("RDW_BASE_URL", "https://opendata.rdw.nl").rstrip("/")
+    BASE_URL_VEHICLES = f"{BASE_URL}/resource/m9d7-ebf2.json"
+    BASE_URL_FUEL = f"{BASE_URL}/resource/8ys7-d773.json"
+    
+    # (connect, read) timeout in seconden
+    CONNECT_TIMEOUT = float(os.environ.get("RDW_CONNECT_TIMEOUT", 3.05))
+    READ_TIMEOUT = float(os.environ.get("RDW_READ_TIMEOUT", 10))
+    POOL_SIZE = int(os.environ.get("RDW_POOL_SIZE", 10))
+    
+    # Eerst de lokale kopie van de open data raadplegen (zie rdw_mirror.py)
+    USE_LOCAL_MIRROR = os.environ.get("RDW_USE_LOCAL_MIRROR", "").lower() in ("1", "true", "yes")
+    
+    _session = None
+    _executor = None
+    _lock = threading.Lock()
+    _inflight = SingleFlight()
+    
+    @classmethod
+    def get_session(cls):
+        """
+        Geef de gedeelde HTTP-sessie terug en maak deze zo nodig aan
+        
+        Returns:
+            requests.Session: Sessie met keep-alive verbindingen naar de RDW
+        """
+        if cls._session is None:
+            with cls._lock:
+                if cls._session is None:
+                    retry = Retry(total=2, connect=2, read=0, backoff_factor=0.2,
+                                  status_forcelist=(502, 503, 504), allowed_methods=("GET",))
+                    adapter = HTTPAdapter(pool_connections=2, pool_maxsize=cls.POOL_SIZE,
+                                          max_retries=retry)
+                    session = requests.Session()
+                    session.mount("https://", adapter)
+                    session.mount("http://", adapter)
+                    session.headers.update({"Accept": "application/json"})
+                    cls._session = session
+        return cls._session
+    
+    @classmethod
+    def _get_executor(cls):
+        if cls._executor is None:
+            with cls._lock:
+                if cls._executor is None:
+                    cls._executor = ThreadPoolExecutor(max_workers=cls.POOL_SIZE,
+                                                       thread_name_prefix="rdw")
+        return cls._executor
+    
+    @classmethod
+    def close(cls):
+        """Sluit de gedeelde sessie, bijvoorbeeld na het wijzigen van BASE_URL in tests"""
+        with cls._lock:
+            if cls._session is not None:
+                cls._session.close()
+                cls._session = None
+    
+    @staticmethod
+    def normalize_plate(license_plate):
+        """Verwijder streepjes en spaties en maak hoofdletters"""
+        return license_plate.replace("-", "").replace(" ", "").upper()
+    
+    @classmethod
+    def _get_json(cls, url, params):
+        """
+        Voer een GET-verzoek uit en geef de JSON-lijst terug
+        
+        Raises:
+            RDWApiError: Bij timeouts, verbindingsfouten of een HTTP-foutstatus
+        """
+        try:
+            response = cls.get_session().get(url, params=params,
+                                             timeout=(cls.CONNECT_TIMEOUT, cls.READ_TIMEOUT))
+        except requests.RequestException as e:
+            raise RDWApiError(f"RDW API niet bereikbaar: {e}") from e
+        
+        if response.status_code != 200:
+            raise RDWApiError(f"API fout {response.status_code} - {response.text[:200]}")
+        
+        try:
+            return response.json()
+        except ValueError as e:
+            raise RDWApiError(f"Ongeldige JSON van RDW API: {e}") from e
+    
+    @classmethod
+    def fetch_vehicle(cls, clean_plate):
+        """
+        Haal voertuig- en brandstofgegevens parallel op
+        
+        Gelijktijdige opvragingen van hetzelfde kenteken binnen dit proces
+        delen één lopend verzoek naar de RDW. Met ``USE_LOCAL_MIRROR`` komt
+        het antwoord eerst uit de lokale kopie.
+        
+        Args:
+            clean_plate (str): Genormaliseerd kenteken
+        
+        Returns:
+            dict: Geformatteerde voertuiginformatie, of None als het kenteken niet bestaat
+        
+        Raises:
+            RDWApiError: Als de voertuiggegevens niet opgehaald konden worden
+        """
+        if cls.USE_LOCAL_MIRROR:
+            mirrored = cls._mirror_lookup([clean_plate])
+            if clean_plate in mirrored:
+                return mirrored[clean_plate]
+        return cls._inflight.do(clean_plate, cls._fetch_vehicle, clean_plate)
+    
+    @classmethod
+    def _mirror_lookup(cls, plates):
+        """Geformatteerde gegevens uit de lokale kopie; onbekende kentekens ontbreken"""
+        import rdw_mirror
+        try:
+            found = rdw_mirror.lookup_many(plates)
+        except Exception as e:
+            # Een kapotte of ontbrekende kopie mag de live opvraag niet blokkeren
+            logger.error(f"Fout bij opvragen lokale RDW-kopie: {e}")
+            return {}
+        return {plate: cls._format_vehicle_data(data) for plate, data in found.items()}
+    
+    @classmethod
+    def inflight_stats(cls):
+        """Aantal uitgevoerde en samengevoegde opvragingen in dit proces"""
+        return {'executed': cls._inflight.executed, 'coalesced': cls._inflight.coalesced}
+    
+    @classmethod
+    def _fetch_vehicle(cls, clean_plate):
+        fuel_future = cls._get_executor().submit(cls.get_fuel_info, clean_plate)
+        try:
+            data = cls._get_json(cls.BASE_URL_VEHICLES, {"kenteken": clean_plate})
+        except RDWApiError:
+            fuel_future.cancel()
+            raise
+        
+        if not data:
+            fuel_future.cancel()
+            return None
+        
+        vehicle_data = data[0]
+        
+        # Combineer voertuig- en brandstofgegevens
+        fuel_info = fuel_future.result()
+        if fuel_info:
+            vehicle_data.update(fuel_info)
+        
+        # Pas veldnamen aan naar bruikbaar formaat
+        return cls._format_vehicle_data(vehicle_data)
+    
+    @classmethod
+    def _fetch_batch(cls, url, plates):
+        """Haal alle regels voor een lijst kentekens op met één ``kenteken in (...)`` filter"""
+        quoted = ", ".join(f"'{plate}'" for plate in plates)
+        params = {
+            "$where": f"kenteken in ({quoted})",
+            # Brandstof kan meerdere regels per kenteken hebben (bijv. hybride)
+            "$limit": len(plates) * 4,
+        }
+        return cls._get_json(url, params)
+    
+    @classmethod
+    def fetch_many(cls, plates, batch_size=50):
+        """
+        Haal voertuig- en brandstofgegevens op voor veel kentekens tegelijk
+        
+        Per batch gaat er één verzoek naar elke dataset in plaats van twee
+        per kenteken; alle verzoeken lopen parallel via de gedeelde pool.
+        
+        Args:
+            plates (list): Genormaliseerde kentekens (alleen letters en cijfers)
+            batch_size (int): Aantal kentekens per SoQL-verzoek
+        
+        Returns:
+            dict: Kenteken -> geformatteerde voertuiginformatie; ontbrekende
+            kentekens zijn niet gevonden
+        
+        Raises:
+            RDWApiError: Als een batch voertuiggegevens niet opgehaald kon worden
+            ValueError: Bij een kenteken met ongeldige tekens
+        """
+        for plate in plates:
+            if not plate.isalnum():
+                raise ValueError(f"Ongeldig kenteken: {plate!r}")
+        
+        mirrored = {}
+        if cls.USE_LOCAL_MIRROR:
+            mirrored = cls._mirror_lookup(plates)
+            plates = [plate for plate in plates if plate not in mirrored]
+        
+        batches = [plates[i:i + batch_size] for i in range(0, len(plates), batch_size)]
+        executor = cls._get_executor()
+        vehicle_futures = [executor.submit(cls._fetch_batch, cls.BASE_URL_VEHICLES, b) for b in batches]
+        fuel_futures = [executor.submit(cls._fetch_batch, cls.BASE_URL_FUEL, b) for b in batches]
+        
+        vehicles = {}
+        for future in vehicle_futures:
+            for row in future.result():
+                vehicles.setdefault(row.get("kenteken"), row)
+        
+        for future in fuel_futures:
+            try:
+                rows = future.result()
+            except RDWApiError as e:
+                # Zonder brandstofgegevens is het voertuig nog steeds bruikbaar
+                logger.error(f"Fout bij opvragen brandstofgegevens (batch): {e}")
+                continue
+            seen = set()
+            for row in rows:
+                plate = row.get("kenteken")
+                if plate in vehicles and plate not in seen:
+                    seen.add(plate)
+                    vehicles[plate] = {**vehicles[plate], **row}
+        
+        mirrored.update((plate, cls._format_vehicle_data(data)) for plate, data in vehicles.items())
+        return mirrored
     
     @classmethod
     def search_by_license_plate(cls, license_plate):
@@ -24,33 +288,14 @@ class RDWApi:
         Returns:
             dict: Voertuiginformatie of None als er geen overeenkomend voertuig is gevonden
         """
+        clean_plate = cls.normalize_plate(license_plate)
         try:
-            # Verwijder streepjes en maak hoofdletters
-            clean_plate = license_plate.replace("-", "").replace(" ", "").upper()
-            
-            # Vraag voertuiggegevens op
-            response = requests.get(f"{cls.BASE_URL_VEHICLES}?kenteken={clean_plate}")
-            
-            if response.status_code == 200:
-                data = response.json()
-                
-                if data and len(data) > 0:
-                    vehicle_data = data[0]
-                    
-                    # Haal brandstofgegevens op
-                    fuel_info = cls.get_fuel_info(clean_plate)
-                    
-                    # Combineer voertuig- en brandstofgegevens
-                    if fuel_info:
-                        vehicle_data.update(fuel_info)
-                    
-                    # Pas veldnamen aan naar bruikbaar formaat
-                    return cls._format_vehicle_data(vehicle_data)
-                else:
-                    logger.warning(f"Geen voertuig gevonden met kenteken: {clean_plate}")
-            else:
-                logger.error(f"API fout bij opvragen voertuig: {response.status_code} - {response.text}")
-        
+            vehicle = cls.fetch_vehicle(clean_plate)
+            if vehicle is None:
+                logger.warning(f"Geen voertuig gevonden met kenteken: {clean_plate}")
+            return vehicle
+        except RDWApiError as e:
+            logger.error(f"Fout bij opvragen voertuig {clean_plate}: {e}")
         except Exception as e:
             logger.exception(f"Fout bij opvragen voertuiggegevens: {str(e)}")
         
@@ -68,14 +313,9 @@ class RDWApi:
             dict: Brandstofgegevens of None als niet gevonden
         """
         try:
-            response = requests.get(f"{cls.BASE_URL_FUEL}?kenteken={license_plate}")
-            
-            if response.status_code == 200:
-                data = response.json()
-                
-                if data and len(data) > 0:
-                    return data[0]
-            
+            data = cls._get_json(cls.BASE_URL_FUEL, {"kenteken": license_plate})
+            if data:
+                return data[0]
         except Exception as e:
             logger.error(f"Fout bij opvragen brandstofgegevens: {str(e)}")
         
@@ -0,0 +1,127 @@
+"""
+Opzoekcache voor RDW-kentekens.
+
+Resultaten worden in de tabel ``rdw_lookup_cache`` bewaard, zodat alle
+workers ze delen. Een kleine cache per proces ervoor maakt herhaalde
+hits sneller dan een databasequery.
+"""
+import json
+import logging
+import threading
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy.exc import IntegrityError
+
+from app import db
+from cache import TTLCache
+from models import RDWLookupCache
+from rdw_api import RDWApi, RDWApiError
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+# Per-process copy of recently used entries: plate -> formatted data or None
+_local_cache = TTLCache(ttl=300, maxsize=2048)
+
+_stats_lock = threading.Lock()
+_stats = {'hits': 0, 'negative_hits': 0, 'misses': 0, 'expired': 0, 'errors': 0}
+
+
+def _count(name):
+    with _stats_lock:
+        _stats[name] += 1
+
+
+def get_stats():
+    """Hit/miss/expiry counters of this worker"""
+    with _stats_lock:
+        stats = dict(_stats)
+    total = stats['hits'] + stats['negative_hits'] + stats['misses']
+    stats['hit_rate'] = round((stats['hits'] + stats['negative_hits']) / total, 3) if total else 0.0
+    stats['upstream'] = RDWApi.inflight_stats()
+    return stats
+
+
+def lookup(license_plate):
+    """
+    Zoek een kenteken op, eerst in de cache en daarna bij de RDW
+
+    Args:
+        license_plate (str): Kenteken in willekeurig formaat
+
+    Returns:
+        dict: Voertuiginformatie, of None als er niets gevonden is of de RDW onbereikbaar is
+    """
+    plate = RDWApi.normalize_plate(license_plate)
+    if not plate:
+        return None
+
+    cached = _local_cache.get(plate, _MISSING)
+    if cached is not _MISSING:
+        _count('hits' if cached is not None else 'negative_hits')
+        return cached
+
+    now = datetime.utcnow()
+    entry = db.session.get(RDWLookupCache, plate)
+    if entry is not None:
+        if entry.expires_at > now:
+            data = json.loads(entry.data) if entry.data else None
+            _count('hits' if data is not None else 'negative_hits')
+            _remember_locally(plate, data, entry.expires_at, now)
+            return data
+        _count('expired')
+
+    _count('misses')
+    try:
+        data = RDWApi.fetch_vehicle(plate)
+    except RDWApiError as e:
+        # Upstream errors are not cached, the next lookup tries again
+        _count('errors')
+        logger.error(f"RDW opzoeken mislukt voor {plate}: {e}")
+        return None
+
+    store(plate, data, now)
+    return data
+
+
+def store(plate, data, now=None):
+    """Sla een (eventueel negatief) resultaat op voor alle workers"""
+    now = now or datetime.utcnow()
+    if data is not None:
+        ttl = current_app.config['RDW_CACHE_TTL']
+    else:
+        ttl = current_app.config['RDW_NEGATIVE_CACHE_TTL']
+    expires_at = now + timedelta(seconds=ttl)
+
+    try:
+        db.session.merge(RDWLookupCache(
+            license_plate=plate,
+            data=json.dumps(data) if data is not None else None,
+            expires_at=expires_at,
+            created_at=now,
+        ))
+        db.session.commit()
+    except IntegrityError:
+        # Another worker stored the same plate at the same moment
+        db.session.rollback()
+
+    _remember_locally(plate, data, expires_at, now)
+
+
+def _remember_locally(plate, data, expires_at, now):
+    remaining = (expires_at - now).total_seconds()
+    _local_cache.set(plate, data, ttl=min(remaining, _local_cache.ttl))
+
+
+def purge_expired():
+    """Verwijder verlopen regels; geeft het aantal verwijderde regels terug"""
+    deleted = RDWLookupCache.query.filter(
+        RDWLookupCache.expires_at <= datetime.utcnow()
+    ).delete(synchronize_session=False)
+    db.session.commit()
+    _local_cache.clear()
+    return deleted
+
@@ -0,0 +1,171 @@
+"""
+Lokale kopie van de RDW open data.
+
+De RDW publiceert de datasets ``m9d7-ebf2`` (voertuigen) en ``8ys7-d773``
+(brandstof) als volledige CSV-export. ``import_csv`` laadt zo'n bestand in
+blokken in de tabellen ``rdw_mirror_vehicle`` en ``rdw_mirror_fuel``; een
+nieuwe export over een bestaande kopie heen importeren werkt alleen de
+gewijzigde kentekens bij.
+
+Met ``RDW_USE_LOCAL_MIRROR=1`` raadpleegt ``RDWApi`` eerst deze tabellen en
+valt alleen voor onbekende kentekens terug op de live API.
+"""
+import csv
+import json
+import logging
+import re
+from datetime import datetime
+
+from sqlalchemy import insert, select
+
+from app import db
+from models import RDWMirrorFuel, RDWMirrorVehicle
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+DATASETS = {
+    'vehicles': RDWMirrorVehicle,
+    'fuel': RDWMirrorFuel,
+}
+
+DEFAULT_CHUNK_SIZE = 5000
+
+_NON_WORD = re.compile(r'[^0-9a-z]+')
+
+
+def normalize_header(name):
+    """Zet een CSV-kolomkop (``Datum eerste toelating``) om naar de API-veldnaam"""
+    return _NON_WORD.sub('_', name.strip().lower()).strip('_')
+
+
+def _read_rows(fileobj, dataset):
+    """Lees de CSV als stroom van (kenteken, record)-paren"""
+    reader = csv.reader(fileobj)
+    try:
+        header = [normalize_header(name) for name in next(reader)]
+    except StopIteration:
+        return
+    if 'kenteken' not in header:
+        raise ValueError("CSV-bestand heeft geen kolom 'Kenteken'")
+
+    for row in reader:
+        record = {name: value.strip() for name, value in zip(header, row) if value.strip()}
+        plate = record.get('kenteken', '').replace('-', '').upper()
+        if not plate:
+            continue
+        # Alleen de eerste brandstof per kenteken, net als de live opvraag
+        if dataset == 'fuel' and record.get('brandstof_volgnummer', '1') != '1':
+            continue
+        record['kenteken'] = plate
+        yield plate, record
+
+
+def _upsert(model, rows):
+    """
+    Voeg een blok regels toe of werk ze bij
+
+    Op PostgreSQL en SQLite gaat dit met één ``INSERT ... ON CONFLICT``;
+    regels waarvan de gegevens niet veranderd zijn worden niet herschreven.
+    """
+    dialect = db.engine.dialect.name
+    if dialect in ('postgresql', 'sqlite'):
+        if dialect == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        stmt = dialect_insert(model)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[model.kenteken],
+            set_={'data': stmt.excluded.data, 'updated_at': stmt.excluded.updated_at},
+            where=model.data != stmt.excluded.data,
+        )
+        db.session.execute(stmt, rows)
+    else:
+        plates = [row['kenteken'] for row in rows]
+        db.session.query(model).filter(model.kenteken.in_(plates)).delete(synchronize_session=False)
+        db.session.execute(insert(model), rows)
+
+
+def import_csv(fileobj, dataset, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Importeer een RDW CSV-export in de lokale kopie
+
+    Het bestand wordt als stroom gelezen; per ``chunk_size`` regels volgt
+    één bulk-upsert en een commit, zodat het geheugengebruik begrensd blijft
+    en een afgebroken import gewoon opnieuw gestart kan worden.
+
+    Args:
+        fileobj: Tekstbestand met de CSV-export (met kolomkoppen)
+        dataset (str): ``'vehicles'`` of ``'fuel'``
+        chunk_size (int): Aantal regels per transactie
+
+    Returns:
+        int: Aantal ingelezen regels
+    """
+    model = DATASETS[dataset]
+    now = datetime.utcnow()
+    chunk = {}
+    total = 0
+
+    def flush():
+        try:
+            _upsert(model, list(chunk.values()))
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        chunk.clear()
+
+    for plate, record in _read_rows(fileobj, dataset):
+        # Per blok één regel per kenteken; ON CONFLICT staat geen dubbelen toe
+        chunk[plate] = {'kenteken': plate, 'data': json.dumps(record, sort_keys=True), 'updated_at': now}
+        total += 1
+        if len(chunk) >= chunk_size:
+            flush()
+            logger.info(f"RDW-kopie {dataset}: {total} regels verwerkt")
+
+    if chunk:
+        flush()
+    return total
+
+
+def lookup_many(plates):
+    """
+    Zoek kentekens op in de lokale kopie
+
+    Args:
+        plates (list): Genormaliseerde kentekens
+
+    Returns:
+        dict: Kenteken -> ruwe RDW-gegevens (voertuig en brandstof samengevoegd)
+    """
+    found = {}
+    for i in range(0, len(plates), 500):
+        chunk = plates[i:i + 500]
+        vehicles = db.session.execute(
+            select(RDWMirrorVehicle.kenteken, RDWMirrorVehicle.data)
+            .where(RDWMirrorVehicle.kenteken.in_(chunk))
+        ).all()
+        if not vehicles:
+            continue
+        fuel = dict(db.session.execute(
+            select(RDWMirrorFuel.kenteken, RDWMirrorFuel.data)
+            .where(RDWMirrorFuel.kenteken.in_([plate for plate, _ in vehicles]))
+        ).all())
+        for plate, data in vehicles:
+            record = json.loads(data)
+            if plate in fuel:
+                record.update(json.loads(fuel[plate]))
+            found[plate] = record
+    return found
+
+
+def lookup(plate):
+    """Ruwe RDW-gegevens voor één kenteken, of None als het niet in de kopie staat"""
+    return lookup_many([plate]).get(plate)
+
+
+def counts():
+    """Aantal kentekens per dataset in de lokale kopie"""
+    return {name: db.session.query(model).count() for name, model in DATASETS.items()}
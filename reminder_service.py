@@ -0,0 +1,147 @@
+"""
+Reminder emails for rentals that are due today or overdue.
+
+Run nightly with ``flask send-reminders``. Each reminder template is rendered
+once with SendGrid substitution tags (``-naam-``, ``-kenteken-``, ...); the
+recipients are grouped into outbox messages of at most ``batch_size``
+personalizations, so hundreds of reminders take a handful of API calls.
+Every queued reminder is recorded in ``rental_reminder``, which makes reruns
+on the same day a no-op.
+"""
+import logging
+from datetime import date, datetime, timedelta
+from html import escape
+
+from flask import render_template
+from sqlalchemy import and_, case, insert, literal
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import aliased
+
+from app import db
+import email_service
+from models import Customer, Rental, RentalReminder, Vehicle
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+DUE_TODAY = 'due_today'
+OVERDUE = 'overdue'
+
+# SendGrid accepts up to 1000 personalizations per request; more is a
+# permanent 4xx error that would dead-letter the whole batch
+MAX_BATCH_SIZE = 1000
+DEFAULT_BATCH_SIZE = 500
+
+TEMPLATES = {
+    DUE_TODAY: ('emails/reminder_due_today.html', 'Herinnering: -onderwerp_voertuig- vandaag terugbrengen'),
+    OVERDUE: ('emails/reminder_overdue.html', 'Uw huurauto -onderwerp_kenteken- is te laat'),
+}
+
+
+def find_due_reminders(today, overdue_interval=1):
+    """
+    Rentals that need a reminder today, in one query
+
+    Active rentals ending today get a ``due_today`` reminder once; overdue
+    rentals get an ``overdue`` reminder every ``overdue_interval`` days.
+    Rentals that already got their reminder are filtered out by an
+    anti-join on ``rental_reminder``.
+
+    Returns:
+        list: Rows with rental_id, kind, end_date, customer and vehicle columns
+    """
+    kind = case((Rental.end_date == today, literal(DUE_TODAY)), else_=literal(OVERDUE))
+    # A due-today reminder counts for today only; an overdue one for the interval
+    since = case((Rental.end_date == today, today), else_=today - timedelta(days=overdue_interval - 1))
+    sent = aliased(RentalReminder)
+
+    return db.session.query(
+        Rental.id.label('rental_id'),
+        kind.label('kind'),
+        Rental.end_date,
+        Customer.first_name,
+        Customer.last_name,
+        Customer.email,
+        Vehicle.make,
+        Vehicle.model,
+        Vehicle.license_plate,
+    ).join(Customer, Rental.customer_id == Customer.id).join(
+        Vehicle, Rental.vehicle_id == Vehicle.id
+    ).outerjoin(sent, and_(
+        sent.rental_id == Rental.id,
+        sent.kind == kind,
+        sent.reminder_date >= since,
+    )).filter(
+        Rental.status == 'active',
+        Rental.end_date <= today,
+        sent.id.is_(None),
+    ).order_by(Rental.id).all()
+
+
+def _recipient(row, today):
+    vehicle = f"{row.make} {row.model}"
+    return {
+        'email': row.email,
+        'substitutions': {
+            # Body tags are inserted into HTML as-is, so escape them
+            '-naam-': escape(f"{row.first_name} {row.last_name}"),
+            '-voertuig-': escape(vehicle),
+            '-kenteken-': escape(row.license_plate),
+            '-einddatum-': row.end_date.strftime('%d-%m-%Y'),
+            '-dagen-': str((today - row.end_date).days),
+            # The subject is plain text
+            '-onderwerp_voertuig-': vehicle,
+            '-onderwerp_kenteken-': row.license_plate,
+        },
+    }
+
+
+def send_reminders(today=None, batch_size=DEFAULT_BATCH_SIZE, overdue_interval=1, dry_run=False):
+    """
+    Queue reminder emails for all rentals due today or overdue
+
+    Args:
+        today (date): Date to send reminders for (default: today)
+        batch_size (int): Maximum recipients per outbox message / API call,
+            at most MAX_BATCH_SIZE
+        overdue_interval (int): Days between overdue reminders for one rental
+        dry_run (bool): Only count what would be sent
+
+    Returns:
+        dict: Number of reminders queued per kind and the number of messages
+    """
+    today = today or date.today()
+    batch_size = max(1, min(batch_size, MAX_BATCH_SIZE))
+    rows = find_due_reminders(today, overdue_interval)
+    result = {DUE_TODAY: 0, OVERDUE: 0, 'messages': 0}
+
+    for kind, (template, subject) in TEMPLATES.items():
+        kind_rows = [row for row in rows if row.kind == kind]
+        if not kind_rows:
+            continue
+        if dry_run:
+            result[kind] = len(kind_rows)
+            continue
+
+        html_content = render_template(template)
+        for i in range(0, len(kind_rows), batch_size):
+            batch = kind_rows[i:i + batch_size]
+            try:
+                email = email_service.queue_email(
+                    [_recipient(row, today) for row in batch], subject, html_content, commit=False)
+                db.session.execute(insert(RentalReminder), [
+                    {'rental_id': row.rental_id, 'kind': kind, 'reminder_date': today,
+                     'email_id': email.id, 'created_at': datetime.utcnow()}
+                    for row in batch
+                ])
+                db.session.commit()
+            except IntegrityError:
+                # A concurrent run queued (part of) this batch already
+                db.session.rollback()
+                logger.warning(f"Skipped a {kind} reminder batch that was already queued")
+                continue
+            result[kind] += len(batch)
+            result['messages'] += 1
+
+    logger.info(f"Reminders for {today}: {result}")
+    return result
@@ -0,0 +1,212 @@
+import logging
+import os
+from collections import namedtuple
+from datetime import date
+
+from sqlalchemy import Float, case, cast, func, literal
+
+from app import db
+from cache import TTLCache, invalidate_on_write
+from models import Rental, Vehicle, VehicleExpense
+from pagination import keyset_paginate, parse_sort
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+GRANULARITIES = ('day', 'week', 'month')
+REPORT_CACHE_TTL = int(os.environ.get('REPORT_CACHE_TTL', 300))
+
+RevenueResult = namedtuple('RevenueResult', ['month', 'revenue'])
+
+# Rentals that count as revenue and as days the vehicle was out
+REVENUE_STATUSES = ('active', 'completed')
+
+_revenue_cache = TTLCache(ttl=REPORT_CACHE_TTL, maxsize=64)
+invalidate_on_write(_revenue_cache, Rental)
+
+_profitability_cache = TTLCache(ttl=REPORT_CACHE_TTL, maxsize=256)
+invalidate_on_write(_profitability_cache, Rental, Vehicle, VehicleExpense)
+
+
+def default_revenue_range(today=None, months=6):
+    """First day of the month ``months - 1`` months ago up to today"""
+    today = today or date.today()
+    month_index = today.year * 12 + today.month - 1 - (months - 1)
+    return date(month_index // 12, month_index % 12 + 1, 1), today
+
+
+def _bucket_expression(column, granularity):
+    """SQL expression that turns a date column into a sortable bucket label"""
+    dialect = db.engine.dialect.name
+
+    if dialect == 'postgresql':
+        if granularity == 'day':
+            return func.to_char(column, 'YYYY-MM-DD')
+        if granularity == 'week':
+            return func.to_char(func.date_trunc('week', column), 'YYYY-MM-DD')
+        return func.to_char(func.date_trunc('month', column), 'YYYY-MM')
+
+    # SQLite: weeks start on Monday, like date_trunc('week') in PostgreSQL
+    if granularity == 'day':
+        return func.strftime('%Y-%m-%d', column)
+    if granularity == 'week':
+        return func.date(column, 'weekday 0', '-6 days')
+    return func.strftime('%Y-%m', column)
+
+
+def get_revenue(date_from, date_to, granularity='month'):
+    """
+    Revenue of active and completed rentals per period, computed in SQL
+
+    Args:
+        date_from (date): First start date to include
+        date_to (date): Last start date to include
+        granularity (str): 'day', 'week' or 'month'
+
+    Returns:
+        list: RevenueResult(month, revenue) tuples sorted by period
+    """
+    if granularity not in GRANULARITIES:
+        raise ValueError(f"Unknown granularity: {granularity}")
+
+    key = (date_from, date_to, granularity)
+    return _revenue_cache.get_or_set(key, lambda: _query_revenue(date_from, date_to, granularity))
+
+
+def _query_revenue(date_from, date_to, granularity):
+    bucket = _bucket_expression(Rental.start_date, granularity).label('bucket')
+    rows = db.session.query(
+        bucket,
+        func.coalesce(func.sum(Rental.total_cost), 0).label('revenue')
+    ).filter(
+        Rental.status.in_(REVENUE_STATUSES),
+        Rental.start_date >= date_from,
+        Rental.start_date <= date_to,
+    ).group_by(bucket).order_by(bucket).all()
+
+    return [RevenueResult(str(row.bucket), float(row.revenue)) for row in rows]
+
+
+def default_profitability_range(today=None):
+    """The current calendar year up to today"""
+    today = today or date.today()
+    return date(today.year, 1, 1), today
+
+
+def _days_between(first, last):
+    """SQL expression for the number of days from ``first`` to ``last``, inclusive"""
+    if db.engine.dialect.name == 'postgresql':
+        return last - first + 1
+    return cast(func.julianday(last) - func.julianday(first) + 1, Float)
+
+
+def _profitability_query(date_from, date_to):
+    """
+    Revenue, expenses, margin and utilization per vehicle as one statement
+
+    Rentals and expenses are aggregated per vehicle in their own subqueries
+    and joined to the vehicles, so every vehicle row is produced once
+    without multiplying rentals by expenses. Revenue counts the rentals
+    that start in the period, like the revenue report; utilization counts
+    the rented days that fall inside the period.
+    """
+    period_days = (date_to - date_from).days + 1
+    if db.engine.dialect.name == 'postgresql':
+        first_day, last_day = func.greatest(Rental.start_date, date_from), func.least(Rental.end_date, date_to)
+    else:
+        first_day, last_day = func.max(Rental.start_date, date_from), func.min(Rental.end_date, date_to)
+
+    rentals = db.session.query(
+        Rental.vehicle_id.label('vehicle_id'),
+        func.sum(case((Rental.start_date >= date_from, Rental.total_cost), else_=0)).label('revenue'),
+        func.count(Rental.id).label('rental_count'),
+        func.sum(_days_between(first_day, last_day)).label('rented_days'),
+    ).filter(
+        Rental.status.in_(REVENUE_STATUSES),
+        Rental.start_date <= date_to,
+        Rental.end_date >= date_from,
+    ).group_by(Rental.vehicle_id).subquery()
+
+    expenses = db.session.query(
+        VehicleExpense.vehicle_id.label('vehicle_id'),
+        func.sum(VehicleExpense.amount).label('expenses'),
+    ).filter(
+        VehicleExpense.date >= date_from,
+        VehicleExpense.date <= date_to,
+    ).group_by(VehicleExpense.vehicle_id).subquery()
+
+    revenue = func.coalesce(rentals.c.revenue, 0)
+    expense_total = func.coalesce(expenses.c.expenses, 0)
+    rented_days = func.coalesce(rentals.c.rented_days, 0)
+    report = db.session.query(
+        Vehicle.id.label('vehicle_id'),
+        Vehicle.license_plate.label('license_plate'),
+        Vehicle.make.label('make'),
+        Vehicle.model.label('model'),
+        cast(revenue, Float).label('revenue'),
+        cast(expense_total, Float).label('expenses'),
+        cast(revenue - expense_total, Float).label('margin'),
+        func.coalesce(rentals.c.rental_count, 0).label('rental_count'),
+        cast(rented_days, Float).label('rented_days'),
+        cast(rented_days * 100.0 / literal(period_days), Float).label('utilization'),
+    ).outerjoin(rentals, rentals.c.vehicle_id == Vehicle.id).outerjoin(
+        expenses, expenses.c.vehicle_id == Vehicle.id
+    ).subquery()
+    return report
+
+
+def profitability_sort_columns(report):
+    """Allowed sort keys of the profitability report mapped to its columns"""
+    return {
+        'margin': report.c.margin,
+        'revenue': report.c.revenue,
+        'expenses': report.c.expenses,
+        'utilization': report.c.utilization,
+        'license_plate': report.c.license_plate,
+    }
+
+
+def get_profitability(date_from, date_to, sort='-margin', cursor=None, per_page=25):
+    """
+    One page of the per-vehicle profitability report, cached per period
+
+    Sorting and keyset pagination happen in SQL on the aggregated rows, so
+    ranking the whole fleet is a single query.
+
+    Args:
+        date_from (date): First day of the period
+        date_to (date): Last day of the period
+        sort (str): Sort key, a leading ``-`` means descending
+        cursor (str): Cursor of the previous page
+        per_page (int): Page size
+
+    Returns:
+        tuple: (KeysetPage with report rows as dicts, normalized sort value)
+    """
+    key = ('page', date_from, date_to, sort, cursor, per_page)
+
+    def load():
+        report = _profitability_query(date_from, date_to)
+        sort_value, columns, descending = parse_sort(
+            sort, profitability_sort_columns(report), report.c.vehicle_id, default='-margin')
+        page = keyset_paginate(db.session.query(report), columns, cursor=cursor,
+                               per_page=per_page, descending=descending)
+        page.items = [row._asdict() for row in page.items]
+        return page, sort_value
+
+    return _profitability_cache.get_or_set(key, load)
+
+
+def get_profitability_totals(date_from, date_to):
+    """Fleet totals of the profitability report for a period"""
+    def load():
+        report = _profitability_query(date_from, date_to)
+        row = db.session.query(
+            func.coalesce(func.sum(report.c.revenue), 0).label('revenue'),
+            func.coalesce(func.sum(report.c.expenses), 0).label('expenses'),
+            func.coalesce(func.sum(report.c.margin), 0).label('margin'),
+            func.coalesce(func.avg(report.c.utilization), 0).label('utilization'),
+        ).one()
+        return {key: float(value) for key, value in row._asdict().items()}
+
+    return _profitability_cache.get_or_set(('totals', date_from, date_to), load)
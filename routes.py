@@ -1,13 +1,25 @@
 from datetime import datetime, date
-from flask import render_template, request, redirect, url_for, flash, jsonify, send_file, abort, current_app
-from sqlalchemy import desc, func
+from flask import render_template, request, redirect, url_for, flash, jsonify, abort, current_app, Response, stream_with_context
+from sqlalchemy import desc, or_
 from flask_login import login_required, current_user
+import io
 import os
 from werkzeug.utils import secure_filename
 
 from app import app, db
 from models import Vehicle, Customer, Rental, VehicleExpense, VehicleDocument
+import availability_service
+import bulk_import
+import dashboard_service
 import document_service
+import export_service
+import fleet_import
+import occupancy_service
+import rdw_cache
+import report_service
+import storage
+import thumbnail_service
+from pagination import keyset_paginate, link_params, parse_per_page, parse_sort
 from auth import permission_required
 
 # Add jinja date helpers
@@ -31,49 +43,54 @@ def login_redirect():
 @login_required
 @permission_required('view_dashboard')
 def dashboard():
-    # Get counts for the dashboard
-    vehicle_count = Vehicle.query.count()
-    available_vehicles = Vehicle.query.filter_by(status='available').count()
-    customer_count = Customer.query.count()
-    active_rentals = Rental.query.filter_by(status='active').count()
-    
-    # Get recent rentals
-    recent_rentals = Rental.query.order_by(desc(Rental.created_at)).limit(5).all()
-    
-    # Get vehicles due for return today
-    today = date.today()
-    due_today = Rental.query.filter_by(status='active').filter(Rental.end_date == today).all()
-    
-    # Get overdue rentals
-    overdue = Rental.query.filter_by(status='active').filter(Rental.end_date < today).all()
-    
-    # Get recent expenses
-    recent_expenses = VehicleExpense.query.order_by(desc(VehicleExpense.created_at)).limit(5).all()
-    
-    # Get total expenses by type
-    expenses_by_type = db.session.query(
-        VehicleExpense.expense_type, 
-        func.sum(VehicleExpense.amount).label('total')
-    ).group_by(VehicleExpense.expense_type).all()
-    
-    return render_template(
-        'dashboard.html',
-        vehicle_count=vehicle_count,
-        available_vehicles=available_vehicles,
-        customer_count=customer_count,
-        active_rentals=active_rentals,
-        recent_rentals=recent_rentals,
-        due_today=due_today,
-        overdue=overdue,
-        recent_expenses=recent_expenses,
-        expenses_by_type=expenses_by_type
-    )
+    return render_template('dashboard.html', **dashboard_service.get_dashboard_data())
 
 # Vehicle routes
+VEHICLE_SORT_COLUMNS = {
+    'make': Vehicle.make,
+    'model': Vehicle.model,
+    'year': Vehicle.year,
+    'license_plate': Vehicle.license_plate,
+    'daily_rate': Vehicle.daily_rate,
+    'id': Vehicle.id,
+}
+VEHICLE_LINK_PARAMS = ('status', 'make', 'model', 'year', 'sort', 'per_page')
+
+def apply_vehicle_filters(query, args):
+    """Apply the status/make/model/year filters from the query string"""
+    status = args.get('status', '').strip()
+    make = args.get('make', '').strip()
+    model = args.get('model', '').strip()
+    year = args.get('year', type=int)
+    
+    if status:
+        query = query.filter(Vehicle.status == status)
+    if make:
+        query = query.filter(Vehicle.make.ilike(f'%{make}%'))
+    if model:
+        query = query.filter(Vehicle.model.ilike(f'%{model}%'))
+    if year:
+        query = query.filter(Vehicle.year == year)
+    return query
+
 @app.route('/vehicles')
 def vehicles():
-    vehicles = Vehicle.query.all()
-    return render_template('vehicles.html', vehicles=vehicles)
+    sort, sort_columns, descending = parse_sort(request.args.get('sort'), VEHICLE_SORT_COLUMNS, Vehicle.id)
+    query = apply_vehicle_filters(Vehicle.query, request.args)
+    page = keyset_paginate(query, sort_columns,
+                           cursor=request.args.get('cursor'),
+                           per_page=parse_per_page(request.args.get('per_page')),
+                           descending=descending)
+    
+    # Query parameters to keep when linking to the next page
+    filters = link_params(request.args, VEHICLE_LINK_PARAMS)
+    
+    return render_template('vehicles.html',
+                          vehicles=page.items,
+                          page=page,
+                          filters=filters,
+                          sort=sort,
+                          export_formats=export_service.available_formats())
 
 @app.route('/vehicles/lookup', methods=['GET', 'POST'])
 def lookup_vehicle():
@@ -83,11 +100,8 @@ def lookup_vehicle():
     if request.method == 'POST':
         license_plate = request.form['license_plate']
         
-        # Importeer RDW API module
-        from rdw_api import RDWApi
-        
-        # Zoek voertuiginformatie
-        vehicle_data = RDWApi.search_by_license_plate(license_plate)
+        # Zoek voertuiginformatie, via de gedeelde opzoekcache
+        vehicle_data = rdw_cache.lookup(license_plate)
         
         if not vehicle_data:
             error_message = f"Geen voertuiginformatie gevonden voor kenteken {license_plate}. " \
@@ -97,6 +111,79 @@ def lookup_vehicle():
                           vehicle_data=vehicle_data, 
                           error_message=error_message)
 
+@app.route('/vehicles/import-rdw', methods=['GET', 'POST'])
+@login_required
+@permission_required('manage_vehicles')
+def import_vehicles_from_rdw():
+    results = None
+    
+    if request.method == 'POST':
+        text = request.form.get('plates', '')
+        upload = request.files.get('file')
+        if upload and upload.filename:
+            text += '\n' + upload.read().decode('utf-8-sig', errors='replace')
+        
+        plates = fleet_import.parse_plates(text)
+        if not plates:
+            flash('Geen kentekens gevonden in de invoer', 'danger')
+            return redirect(request.url)
+        
+        try:
+            daily_rate = float(request.form['daily_rate'])
+        except (KeyError, ValueError):
+            flash('Vul een geldige dagprijs in', 'danger')
+            return redirect(request.url)
+        
+        results = fleet_import.import_plates(plates, daily_rate,
+                                             status=request.form.get('status', 'available'))
+        added = sum(1 for r in results if r.status == fleet_import.ADDED)
+        flash(f'{added} van {len(results)} voertuigen geïmporteerd', 'success' if added else 'warning')
+    
+    return render_template('vehicle_import.html', results=results)
+
+# Errors shown on the import page; the CLI writes a full report
+IMPORT_ERRORS_SHOWN = 500
+
+def bulk_import_page(kind):
+    """Import form and result page for a customers or vehicles CSV"""
+    report = None
+    
+    if request.method == 'POST':
+        upload = request.files.get('file')
+        if not upload or not upload.filename:
+            flash('Kies een CSV-bestand om te importeren', 'danger')
+            return redirect(request.url)
+        
+        stream = io.TextIOWrapper(upload.stream, encoding='utf-8-sig', errors='replace', newline='')
+        try:
+            report = bulk_import.import_csv(stream, kind, dry_run=bool(request.form.get('dry_run')))
+        except ValueError as e:
+            flash(str(e), 'danger')
+            return redirect(request.url)
+        
+        done = report.counts[bulk_import.INSERTED] + report.counts[bulk_import.UPDATED]
+        flash(f'{report.counts[bulk_import.INSERTED]} toegevoegd, {report.counts[bulk_import.UPDATED]} bijgewerkt, '
+              f'{report.counts[bulk_import.ERROR]} fout(en)',
+              'success' if done and not report.errors else 'warning')
+    
+    return render_template('bulk_import.html',
+                          kind=kind,
+                          spec=bulk_import.IMPORTS[kind],
+                          report=report,
+                          errors_shown=IMPORT_ERRORS_SHOWN)
+
+@app.route('/vehicles/import-csv', methods=['GET', 'POST'])
+@login_required
+@permission_required('manage_vehicles')
+def import_vehicles_csv():
+    return bulk_import_page('vehicles')
+
+@app.route('/customers/import', methods=['GET', 'POST'])
+@login_required
+@permission_required('manage_customers')
+def import_customers_csv():
+    return bulk_import_page('customers')
+
 @app.route('/vehicles/add-from-rdw', methods=['POST'])
 def add_vehicle_from_rdw():
     try:
@@ -268,24 +355,172 @@ def delete_customer(id):
         
     return redirect(url_for('customers'))
 
+def export_response(name, columns, query):
+    """Stream ``query`` as a CSV or XLSX download (``?format=``)"""
+    fmt = request.args.get('format', 'csv')
+    if fmt not in export_service.available_formats():
+        abort(400)
+    
+    response = Response(stream_with_context(export_service.stream_export(fmt, columns, query, name)),
+                        mimetype=export_service.MIMETYPES[fmt])
+    response.headers['Content-Disposition'] = f'attachment; filename="{name}-{date.today().isoformat()}.{fmt}"'
+    # Let nginx pass the chunks on instead of buffering the whole file
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+@app.route('/vehicles/export')
+@login_required
+@permission_required('view_vehicles')
+def export_vehicles():
+    query = apply_vehicle_filters(export_service.vehicle_query(), request.args)
+    return export_response('voertuigen', export_service.VEHICLE_COLUMNS, query)
+
 # Rental routes
+RENTAL_SORT_COLUMNS = {
+    'id': Rental.id,
+    'start_date': Rental.start_date,
+    'end_date': Rental.end_date,
+}
+RENTAL_LINK_PARAMS = ('status', 'date_from', 'date_to', 'customer', 'vehicle', 'sort', 'per_page')
+
+def parse_date_arg(args, name):
+    """Parse a YYYY-MM-DD query parameter, None if missing or invalid"""
+    value = args.get(name, '').strip()
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        return None
+
+def apply_rental_filters(query, args):
+    """Apply the status, date range, customer and vehicle filters from the query string"""
+    status = args.get('status', '').strip()
+    date_from = parse_date_arg(args, 'date_from')
+    date_to = parse_date_arg(args, 'date_to')
+    customer = args.get('customer', '').strip()
+    vehicle = args.get('vehicle', '').strip()
+    
+    if status:
+        query = query.filter(Rental.status == status)
+    # Date range selects every rental that overlaps [date_from, date_to]
+    if date_from:
+        query = query.filter(Rental.end_date >= date_from)
+    if date_to:
+        query = query.filter(Rental.start_date <= date_to)
+    if customer:
+        pattern = f'%{customer}%'
+        query = query.filter(Rental.customer.has(or_(
+            Customer.first_name.ilike(pattern),
+            Customer.last_name.ilike(pattern),
+        )))
+    if vehicle:
+        pattern = f'%{vehicle}%'
+        query = query.filter(Rental.vehicle.has(or_(
+            Vehicle.make.ilike(pattern),
+            Vehicle.model.ilike(pattern),
+            Vehicle.license_plate.ilike(pattern),
+        )))
+    return query
+
 @app.route('/rentals')
 def rentals():
-    rentals = Rental.query.all()
-    return render_template('rentals.html', rentals=rentals)
+    sort, sort_columns, descending = parse_sort(request.args.get('sort'), RENTAL_SORT_COLUMNS,
+                                                Rental.id, default='-id')
+    query = apply_rental_filters(Rental.query_with_relations(), request.args)
+    page = keyset_paginate(query, sort_columns,
+                           cursor=request.args.get('cursor'),
+                           per_page=parse_per_page(request.args.get('per_page')),
+                           descending=descending)
+    
+    # Query parameters to keep when linking to the next page
+    filters = link_params(request.args, RENTAL_LINK_PARAMS)
+    
+    return render_template('rentals.html',
+                          rentals=page.items,
+                          page=page,
+                          filters=filters,
+                          sort=sort,
+                          export_formats=export_service.available_formats())
+
+@app.route('/rentals/export')
+@login_required
+@permission_required('view_rentals')
+def export_rentals():
+    query = apply_rental_filters(export_service.rental_query(), request.args)
+    return export_response('verhuringen', export_service.RENTAL_COLUMNS, query)
+
+@app.route('/rentals/availability')
+@login_required
+def rental_availability():
+    """Vehicles that are free for the whole range start_date..end_date"""
+    start_date = parse_date_arg(request.args, 'start_date')
+    end_date = parse_date_arg(request.args, 'end_date')
+    if not start_date or not end_date or end_date < start_date:
+        return jsonify({'error': 'Geef een geldige start- en einddatum op'}), 400
+    exclude_rental_id = request.args.get('exclude_rental_id', type=int)
+    
+    vehicles = availability_service.free_vehicles(start_date, end_date, exclude_rental_id)
+    return jsonify({
+        'start_date': start_date.isoformat(),
+        'end_date': end_date.isoformat(),
+        'vehicles': [{
+            'id': vehicle.id,
+            'make': vehicle.make,
+            'model': vehicle.model,
+            'year': vehicle.year,
+            'license_plate': vehicle.license_plate,
+            'daily_rate': vehicle.daily_rate,
+        } for vehicle in vehicles],
+    })
+
+@app.route('/rentals/occupancy')
+@login_required
+def rental_occupancy():
+    """Vehicles x days occupancy matrix, e.g. for a planning view"""
+    start_date = parse_date_arg(request.args, 'start_date') or date.today()
+    days = request.args.get('days', occupancy_service.DEFAULT_DAYS, type=int)
+    if days < 1 or days > occupancy_service.MAX_DAYS:
+        return jsonify({'error': f'Aantal dagen moet tussen 1 en {occupancy_service.MAX_DAYS} liggen'}), 400
+    
+    return jsonify(occupancy_service.get_occupancy(start_date, days).to_dict())
+
+def _booking_conflict(vehicle_id, start_date, end_date, exclude_rental_id=None):
+    """Error message if the booking is invalid or overlaps another rental, else None"""
+    if end_date < start_date:
+        return 'End date must be on or after the start date'
+    overlapping = availability_service.overlapping_rentals(vehicle_id, start_date, end_date, exclude_rental_id)
+    if overlapping:
+        other = overlapping[0]
+        return (f'Vehicle is already rented from {other.start_date.strftime("%d-%m-%Y")} '
+                f'to {other.end_date.strftime("%d-%m-%Y")} (rental #{other.id})')
+    return None
 
 @app.route('/rentals/add', methods=['GET', 'POST'])
 def add_rental():
-    # Get available vehicles
-    available_vehicles = Vehicle.query.filter_by(status='available').all()
     customers = Customer.query.all()
     
+    # Offer the vehicles that are free for the chosen period (default: today)
+    start_date = parse_date_arg(request.values, 'start_date') or date.today()
+    end_date = parse_date_arg(request.values, 'end_date') or start_date
+    available_vehicles = availability_service.free_vehicles(start_date, max(start_date, end_date))
+    
     if request.method == 'POST':
         vehicle_id = int(request.form['vehicle_id'])
         customer_id = int(request.form['customer_id'])
         start_date = datetime.strptime(request.form['start_date'], '%Y-%m-%d').date()
         end_date = datetime.strptime(request.form['end_date'], '%Y-%m-%d').date()
         
+        conflict = _booking_conflict(vehicle_id, start_date, end_date)
+        if conflict:
+            flash(conflict, 'danger')
+            return render_template('rental_form.html',
+                                  rental=None,
+                                  vehicles=available_vehicles,
+                                  customers=customers,
+                                  start_date=start_date,
+                                  end_date=end_date)
+        
         # Calculate the total cost
         vehicle = Vehicle.query.get(vehicle_id)
         days = (end_date - start_date).days + 1
@@ -303,10 +538,10 @@ def add_rental():
         )
         
         try:
-            # Update vehicle status
-            vehicle.status = 'rented'
-            
             db.session.add(new_rental)
+            db.session.flush()
+            # Rented only once the booking has started; sync-vehicle-status handles later starts
+            availability_service.refresh_vehicle_status([vehicle_id])
             db.session.commit()
             flash('Rental created successfully!', 'success')
             return redirect(url_for('rentals'))
@@ -317,7 +552,9 @@ def add_rental():
     return render_template('rental_form.html', 
                           rental=None, 
                           vehicles=available_vehicles, 
-                          customers=customers)
+                          customers=customers,
+                          start_date=start_date,
+                          end_date=end_date)
 
 @app.route('/rentals/edit/<int:id>', methods=['GET', 'POST'])
 def edit_rental(id):
@@ -326,14 +563,28 @@ def edit_rental(id):
     customers = Customer.query.all()
     
     if request.method == 'POST':
+        new_vehicle_id = int(request.form['vehicle_id'])
+        new_start_date = datetime.strptime(request.form['start_date'], '%Y-%m-%d').date()
+        new_end_date = datetime.strptime(request.form['end_date'], '%Y-%m-%d').date()
+        
+        # Only a rental that stays active can clash with other bookings
+        if request.form['status'] in availability_service.BLOCKING_STATUSES:
+            conflict = _booking_conflict(new_vehicle_id, new_start_date, new_end_date,
+                                         exclude_rental_id=rental.id)
+            if conflict:
+                flash(conflict, 'danger')
+                return render_template('rental_form.html',
+                                      rental=rental,
+                                      vehicles=vehicles,
+                                      customers=customers)
+        
         # Update the rental
         old_vehicle_id = rental.vehicle_id
-        new_vehicle_id = int(request.form['vehicle_id'])
         
         rental.vehicle_id = new_vehicle_id
         rental.customer_id = int(request.form['customer_id'])
-        rental.start_date = datetime.strptime(request.form['start_date'], '%Y-%m-%d').date()
-        rental.end_date = datetime.strptime(request.form['end_date'], '%Y-%m-%d').date()
+        rental.start_date = new_start_date
+        rental.end_date = new_end_date
         rental.status = request.form['status']
         rental.notes = request.form.get('notes', '')
         
@@ -348,16 +599,9 @@ def edit_rental(id):
         rental.total_cost = days * vehicle.daily_rate
         
         try:
-            # If vehicle changed or rental completed, update vehicle statuses
-            if old_vehicle_id != new_vehicle_id or rental.status == 'completed':
-                old_vehicle = Vehicle.query.get(old_vehicle_id)
-                old_vehicle.status = 'available'
-                
-                if rental.status == 'active':
-                    vehicle.status = 'rented'
-                else:
-                    vehicle.status = 'available'
-            
+            # Status of both vehicles follows the bookings covering today
+            db.session.flush()
+            availability_service.refresh_vehicle_status({old_vehicle_id, new_vehicle_id})
             db.session.commit()
             flash('Rental updated successfully!', 'success')
             return redirect(url_for('rentals'))
@@ -413,28 +657,17 @@ def reports():
         Customer.id, Customer.first_name, Customer.last_name
     ).all()
     
-    # Revenue by month (last 6 months using SQLite approach for compatibility)
+    # Revenue per period, aggregated in SQL for the selected range
+    default_from, default_to = report_service.default_revenue_range()
+    date_from = parse_date_arg(request.args, 'date_from') or default_from
+    date_to = parse_date_arg(request.args, 'date_to') or default_to
+    granularity = request.args.get('granularity', 'month')
+    if granularity not in report_service.GRANULARITIES:
+        granularity = 'month'
+    
     revenue_by_month = []
     try:
-        # Try to fetch the last 6 months of revenue data
-        rentals = Rental.query.filter(Rental.status.in_(['active', 'completed'])).all()
-        
-        # Process the data manually
-        revenue_data = {}
-        for rental in rentals:
-            month_key = f"{rental.start_date.year}-{rental.start_date.month:02d}"
-            if month_key not in revenue_data:
-                revenue_data[month_key] = 0
-            revenue_data[month_key] += rental.total_cost
-        
-        # Convert to a list of objects similar to SQLAlchemy results
-        from collections import namedtuple
-        RevenueResult = namedtuple('RevenueResult', ['month', 'revenue'])
-        
-        # Get the last 6 months or all months if less than 6
-        sorted_months = sorted(revenue_data.keys())[-6:]
-        for month in sorted_months:
-            revenue_by_month.append(RevenueResult(month, revenue_data[month]))
+        revenue_by_month = report_service.get_revenue(date_from, date_to, granularity)
     except Exception as e:
         app.logger.error(f"Error generating revenue report: {str(e)}")
         # Return empty list if there's an error
@@ -442,7 +675,41 @@ def reports():
     return render_template('reports.html',
                           vehicle_status=vehicle_status,
                           customer_rentals=customer_rentals,
-                          revenue_by_month=revenue_by_month)
+                          revenue_by_month=revenue_by_month,
+                          date_from=date_from,
+                          date_to=date_to,
+                          granularity=granularity)
+
+PROFITABILITY_LINK_PARAMS = ('date_from', 'date_to', 'sort', 'per_page')
+
+@app.route('/reports/profitability')
+@login_required
+@permission_required('view_reports')
+def profitability_report():
+    default_from, default_to = report_service.default_profitability_range()
+    date_from = parse_date_arg(request.args, 'date_from') or default_from
+    date_to = parse_date_arg(request.args, 'date_to') or default_to
+    if date_to < date_from:
+        date_from, date_to = date_to, date_from
+    
+    page, sort = report_service.get_profitability(
+        date_from, date_to,
+        sort=request.args.get('sort'),
+        cursor=request.args.get('cursor'),
+        per_page=parse_per_page(request.args.get('per_page')))
+    totals = report_service.get_profitability_totals(date_from, date_to)
+    
+    # Query parameters to keep when linking to the next page
+    filters = link_params(request.args, PROFITABILITY_LINK_PARAMS)
+    
+    return render_template('profitability.html',
+                          rows=page.items,
+                          page=page,
+                          totals=totals,
+                          date_from=date_from,
+                          date_to=date_to,
+                          filters=filters,
+                          sort=sort)
 
 # Vehicle Expenses Routes
 @app.route('/vehicles/<int:vehicle_id>/expenses')
@@ -451,6 +718,30 @@ def vehicle_expenses(vehicle_id):
     expenses = VehicleExpense.query.filter_by(vehicle_id=vehicle_id).order_by(desc(VehicleExpense.date)).all()
     return render_template('vehicle_expenses.html', vehicle=vehicle, expenses=expenses)
 
+def apply_expense_filters(query, args):
+    """Apply the vehicle, type and date range filters from the query string"""
+    vehicle_id = args.get('vehicle_id', type=int)
+    expense_type = args.get('expense_type', '').strip()
+    date_from = parse_date_arg(args, 'date_from')
+    date_to = parse_date_arg(args, 'date_to')
+    
+    if vehicle_id:
+        query = query.filter(VehicleExpense.vehicle_id == vehicle_id)
+    if expense_type:
+        query = query.filter(VehicleExpense.expense_type == expense_type)
+    if date_from:
+        query = query.filter(VehicleExpense.date >= date_from)
+    if date_to:
+        query = query.filter(VehicleExpense.date <= date_to)
+    return query
+
+@app.route('/expenses/export')
+@login_required
+@permission_required('view_expenses')
+def export_expenses():
+    query = apply_expense_filters(export_service.expense_query(), request.args)
+    return export_response('kosten', export_service.EXPENSE_COLUMNS, query)
+
 @app.route('/vehicles/<int:vehicle_id>/expenses/add', methods=['GET', 'POST'])
 def add_expense(vehicle_id):
     vehicle = Vehicle.query.get_or_404(vehicle_id)
@@ -564,6 +855,78 @@ def add_document(vehicle_id):
     
     return render_template('document_form.html', vehicle=vehicle)
 
+# Chunked, resumable uploads (JSON API used by document_form.html for large files)
+def _upload_status(upload):
+    return {
+        'id': upload.id,
+        'offset': upload.offset,
+        'size': upload.size,
+        'chunk_size': document_service.UPLOAD_CHUNK_SIZE,
+        'url': url_for('upload_chunk', upload_id=upload.id),
+    }
+
+@app.route('/vehicles/<int:vehicle_id>/documents/uploads', methods=['POST'])
+@login_required
+def start_document_upload(vehicle_id):
+    Vehicle.query.get_or_404(vehicle_id)
+    data = request.get_json(silent=True) or {}
+    if not data.get('document_type'):
+        return jsonify({'error': 'Selecteer een document type'}), 400
+    
+    try:
+        upload = document_service.create_upload(
+            vehicle_id, data['document_type'], data.get('filename'), data.get('size'),
+            sha256=data.get('sha256'), description=data.get('description'))
+    except document_service.UploadError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(_upload_status(upload)), 201
+
+@app.route('/documents/uploads/<upload_id>', methods=['GET', 'PUT', 'DELETE'])
+@login_required
+def upload_chunk(upload_id):
+    upload = document_service.get_upload(upload_id, for_update=request.method != 'GET')
+    if not upload:
+        abort(404)
+    
+    if request.method == 'GET':
+        return jsonify(_upload_status(upload))
+    
+    if request.method == 'DELETE':
+        document_service.cancel_upload(upload)
+        return '', 204
+    
+    offset = request.headers.get('Upload-Offset', type=int)
+    if offset != upload.offset:
+        # Client is out of sync (e.g. after a dropped connection): resume from here
+        return jsonify({'error': 'Onjuiste offset', **_upload_status(upload)}), 409
+    
+    try:
+        document_service.append_chunk(upload, offset, request.stream,
+                                      chunk_sha256=request.headers.get('X-Chunk-SHA256'))
+    except document_service.UploadError as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 400
+    return jsonify(_upload_status(upload))
+
+@app.route('/documents/uploads/<upload_id>/finalize', methods=['POST'])
+@login_required
+def finalize_document_upload(upload_id):
+    upload = document_service.get_upload(upload_id, for_update=True)
+    if not upload:
+        abort(404)
+    
+    try:
+        document = document_service.finalize_upload(upload)
+    except document_service.UploadError as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 400
+    
+    flash('Document succesvol geüpload!', 'success')
+    return jsonify({
+        'document_id': document.id,
+        'redirect': url_for('vehicle_documents', vehicle_id=document.vehicle_id),
+    }), 201
+
 @app.route('/documents/download/<int:document_id>')
 def download_document(document_id):
     document = document_service.get_document(document_id)
@@ -572,13 +935,29 @@ def download_document(document_id):
         abort(404)
     
     try:
-        return send_file(document.filepath, 
-                         download_name=document.filename, 
-                         as_attachment=True)
+        return document_service.send_document(document)
+    except FileNotFoundError:
+        app.logger.error(f"Document file missing: {document.filepath}")
+        abort(404)
     except Exception as e:
         app.logger.error(f"Error downloading file: {str(e)}")
         abort(500)
 
+@app.route('/documents/<int:document_id>/thumbnail/<size>')
+def document_thumbnail(document_id, size):
+    if size not in thumbnail_service.SIZES:
+        abort(404)
+    
+    document = document_service.get_document(document_id)
+    if not document or not document.is_image():
+        abort(404)
+    
+    response = document_service.send_thumbnail(document, size)
+    if response is None:
+        # Not generated yet (or Pillow missing): show the original for now
+        return redirect(url_for('download_document', document_id=document_id))
+    return response
+
 @app.route('/documents/delete/<int:document_id>', methods=['POST'])
 def delete_document(document_id):
     document = document_service.get_document(document_id)
@@ -595,6 +974,17 @@ def delete_document(document_id):
     
     return redirect(url_for('vehicle_documents', vehicle_id=vehicle_id))
 
+@app.route('/share/<token>')
+def shared_document(token):
+    # Validated from the signed token alone; no database access
+    try:
+        response = document_service.send_shared_file(token)
+    except FileNotFoundError:
+        abort(404)
+    if response is None:
+        abort(404)
+    return response
+
 @app.route('/documents/share/<int:document_id>', methods=['GET', 'POST'])
 def share_document(document_id):
     document = document_service.get_document(document_id)
@@ -602,6 +992,16 @@ def share_document(document_id):
     if not document:
         abort(404)
     
+    max_days = app.config['SHARE_LINK_MAX_DAYS']
+    days = None
+    if request.values.get('days', '').strip():
+        days = request.values.get('days', type=int)
+        if days is None or not 1 <= days <= max_days:
+            flash(f'Een link kan 1 tot {max_days} dagen geldig zijn', 'danger')
+            return redirect(url_for('share_document', document_id=document.id))
+    token, expires = document_service.make_share_link(document, days)
+    download_url = url_for('shared_document', token=token, _external=True)
+    
     if request.method == 'POST':
         email = request.form.get('email')
         
@@ -609,9 +1009,6 @@ def share_document(document_id):
             flash('E-mailadres is verplicht', 'danger')
             return redirect(request.url)
         
-        # Generate download link
-        download_url = request.host_url.rstrip('/') + url_for('download_document', document_id=document.id)
-        
         # Prepare email content
         vehicle = document.vehicle
         html_content = f"""
@@ -621,11 +1018,11 @@ def share_document(document_id):
         <p><strong>Type:</strong> {document.document_type}</p>
         <p><strong>Beschrijving:</strong> {document.description or 'Geen beschrijving'}</p>
         <p>U kunt het document hier downloaden: <a href="{download_url}">Download document</a></p>
-        <p>Deze link is publiek toegankelijk en kan met iedereen gedeeld worden.</p>
+        <p>Deze link is geldig tot {expires:%d-%m-%Y %H:%M} (UTC) en kan met iedereen gedeeld worden.</p>
         """
         
         # Capture the document path for attachment
-        document_path = document.filepath
+        document_path = storage.resolve(document.filepath)
         attachments = [document_path] if os.path.exists(document_path) else []
         
         # We could use the email service here if the user decides to use it in the future
@@ -633,7 +1030,9 @@ def share_document(document_id):
         flash(f'Gebruik deze downloadlink om het document te delen: {download_url}', 'info')
         return redirect(url_for('vehicle_documents', vehicle_id=document.vehicle_id))
     
-    return render_template('share_document.html', document=document)
+    return render_template('share_document.html', document=document, share_url=download_url,
+                           expires=expires, max_days=max_days,
+                           days=days or app.config['SHARE_LINK_DAYS'])
 
 # Error handlers
 @app.errorhandler(404)
@@ -0,0 +1,71 @@
+"""
+Location of uploaded files.
+
+Everything lives under the configured ``UPLOAD_FOLDER``. Documents are
+stored by content hash in two levels of subdirectories, ``ab/cd/abcd…``, so
+no directory holds more than 256 entries plus the files of one shard.
+``VehicleDocument.filepath`` holds that key relative to the upload folder;
+documents from before the sharded layout still have an absolute path
+until ``flask migrate-document-storage`` has moved them.
+"""
+import os
+import re
+
+from flask import current_app, has_app_context
+
+from config import app_config
+
+_SHARDED_KEY = re.compile(r'^([0-9a-f]{2})/([0-9a-f]{2})/([0-9a-f]{64})$')
+
+
+def upload_root():
+    """Absolute path of the upload folder"""
+    if has_app_context():
+        return current_app.config['UPLOAD_FOLDER']
+    return app_config.UPLOAD_FOLDER
+
+
+def partial_dir():
+    """Folder for chunked uploads in progress"""
+    return os.path.join(upload_root(), '.partial')
+
+
+def key_for_hash(sha256):
+    """Storage key of a file with the given SHA-256"""
+    return f"{sha256[:2]}/{sha256[2:4]}/{sha256}"
+
+
+def is_sharded(key):
+    """Whether ``key`` is already in the sharded layout"""
+    match = _SHARDED_KEY.match(key)
+    return bool(match) and match.group(3).startswith(match.group(1) + match.group(2))
+
+
+def resolve(key):
+    """Absolute path for a storage key (or a legacy absolute path)"""
+    if os.path.isabs(key):
+        return key
+    return os.path.join(upload_root(), *key.split('/'))
+
+
+def relative_path(key):
+    """Path of a stored file relative to the upload folder, with forward slashes"""
+    return os.path.relpath(resolve(key), upload_root()).replace(os.sep, '/')
+
+
+def store(path, sha256):
+    """
+    Move a fully written file to its content-addressed location
+
+    The rename is atomic, also when the same content is being stored
+    concurrently. ``path`` must be on the same file system as the upload
+    folder.
+
+    Returns:
+        str: Storage key of the file
+    """
+    key = key_for_hash(sha256)
+    destination = resolve(key)
+    os.makedirs(os.path.dirname(destination), exist_ok=True)
+    os.replace(path, destination)
+    return key
@@ -0,0 +1,121 @@
+"""
+Thumbnails for image documents.
+
+Thumbnails are generated by a small worker pool after an image is saved,
+so the upload request does not wait for them. They are stored next to the
+original as ``<file>.thumb-<size>.jpg``; documents that share a file
+(see ``document_service.store_blob``) share their thumbnails as well.
+
+Requires Pillow (``pip install Pillow``). Without it no thumbnails are
+made and pages fall back to the original image.
+"""
+import os
+import logging
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # pragma: no cover - optional dependency
+    Image = None
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Longest edge in pixels per size name
+SIZES = {'small': 320, 'large': 1024}
+JPEG_QUALITY = 80
+WORKERS = int(os.environ.get('THUMBNAIL_WORKERS', 2))
+
+_executor = None
+_lock = threading.Lock()
+
+def available():
+    """Whether thumbnails can be generated in this environment"""
+    return Image is not None
+
+def thumbnail_path(filepath, size):
+    """Path of the thumbnail of ``filepath`` for a size name"""
+    return f"{filepath}.thumb-{size}.jpg"
+
+def get_thumbnail(filepath, size):
+    """Path of an existing thumbnail, or None if it has not been generated (yet)"""
+    path = thumbnail_path(filepath, size)
+    return path if os.path.exists(path) else None
+
+def generate(filepath):
+    """
+    Generate all missing thumbnails for an image file
+
+    Returns:
+        int: Number of thumbnails written
+    """
+    if Image is None:
+        return 0
+
+    missing = {size: edge for size, edge in SIZES.items()
+               if not os.path.exists(thumbnail_path(filepath, size))}
+    if not missing:
+        return 0
+
+    with Image.open(filepath) as original:
+        # Let the JPEG decoder scale down while reading; much cheaper for large photos
+        original.draft('RGB', (max(missing.values()),) * 2)
+        image = ImageOps.exif_transpose(original)
+        if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
+            # Flatten transparency onto white instead of JPEG's black
+            image = image.convert('RGBA')
+            background = Image.new('RGB', image.size, 'white')
+            background.paste(image, mask=image.getchannel('A'))
+            image = background
+        else:
+            image = image.convert('RGB')
+
+    # Largest first, so every smaller size is made from an already reduced image
+    for size, edge in sorted(missing.items(), key=lambda item: -item[1]):
+        image.thumbnail((edge, edge))
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(filepath), prefix='.thumb-')
+        try:
+            with os.fdopen(fd, 'wb') as tmp:
+                image.save(tmp, 'JPEG', quality=JPEG_QUALITY, optimize=True)
+            os.replace(tmp_path, thumbnail_path(filepath, size))
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+    return len(missing)
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix='thumbnail')
+    return _executor
+
+def _log_failure(filepath):
+    def callback(future):
+        if future.exception() is not None:
+            logger.error(f"Error generating thumbnails for {filepath}: {future.exception()}")
+    return callback
+
+def schedule(filepath):
+    """
+    Generate thumbnails for ``filepath`` in the background
+
+    Returns:
+        Future: The pending job, or None if Pillow is not installed
+    """
+    if Image is None:
+        return None
+    future = _get_executor().submit(generate, filepath)
+    future.add_done_callback(_log_failure(filepath))
+    return future
+
+def remove(filepath):
+    """Remove all thumbnails of a file"""
+    for size in SIZES:
+        path = thumbnail_path(filepath, size)
+        if os.path.exists(path):
+            os.remove(path)